@@ -69,3 +69,51 @@ def interpolate_dots_in_strips(strips, y_interval=10):
 
 
 
+
+
+class BoundaryModel(object):
+    """
+    Strips projected into one camera, each fitted once into a monotone-in-y piecewise-linear x(y).
+    Knots are the strip points sorted by y, with points sharing a y merged into their mean x and optionally
+    Gaussian smoothed along y. Provides the StripIndex interface (strip_ids, strip_cameras, cameras,
+    boundary_x), so Point_Boundary_Seperator can use it in place of nearest-point matching.
+    """
+
+    def __init__(self, strips, sigma=0):
+        grouped = {}
+        for strip_id, point in strips:
+            grouped.setdefault(strip_id, []).append(point)
+        self.strip_ids = list(grouped.keys())
+        self.strip_cameras = [strip_id.split('_')[0] for strip_id in self.strip_ids]
+        self.cameras = set(self.strip_cameras)
+        self._positions = {strip_id: s for s, strip_id in enumerate(self.strip_ids)}
+        self._knots_y, self._knots_x = [], []
+        for points in grouped.values():
+            points_array = np.asarray([point[:2] for point in points], dtype=float)
+            knots_y, inverse = np.unique(points_array[:, 1], return_inverse=True)
+            knots_x = np.bincount(inverse, weights=points_array[:, 0]) / np.bincount(inverse)
+            if sigma and len(knots_x) > 1:
+                knots_x = gaussian_filter(knots_x, sigma=sigma, mode='nearest')
+            self._knots_y.append(knots_y)
+            self._knots_x.append(knots_x)
+
+    def __len__(self):
+        return len(self.strip_ids)
+
+    def knots(self, strip_id):
+        """(y, x) knot arrays of a strip"""
+        s = self._positions[strip_id]
+        return self._knots_y[s], self._knots_x[s]
+
+    def boundary_x(self, strip_id, ys):
+        """x(y) of the strip for any batch of ys, held constant beyond its ends, NaN when the strip is absent"""
+        ys = np.asarray(ys, dtype=float)
+        s = self._positions.get(strip_id)
+        if s is None:
+            return np.full(ys.shape, np.nan)
+        return np.interp(ys, self._knots_y[s], self._knots_x[s])
+
+
+def build_boundary_models(projected_points_to_images, sigma=0):
+    """One BoundaryModel per camera from projected_points_to_images"""
+    return {cam_name: BoundaryModel(strips, sigma) for cam_name, strips in projected_points_to_images.items()}
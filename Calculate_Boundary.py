@@ -1,28 +1,190 @@
-from Utility_For_Calculating_Boundary import distance_to_line_along_local_y, is_near_boundary_and_within_edge, distance_to_line_along_local_y_FOR_LATER
+from Utility_For_Calculating_Boundary import EdgeGeometry, is_near_boundary_and_within_edge, distance_to_line_along_local_y_FOR_LATER
+from Point_Grid_Index import PointGridIndex
 from collections import defaultdict
+import numpy as np
+
+
+def _edge_geometry(edges):
+    """EdgeGeometry for an (E, 2, 3) edge tensor or {cam: [(p1, p2), ...]}, passed through when already built"""
+    if isinstance(edges, EdgeGeometry):
+        return edges
+    if isinstance(edges, dict):
+        return EdgeGeometry.from_frustum_edges(edges)
+    return EdgeGeometry(edges)
+
+
+def point_edge_distances(points, edges, max_distance=None):
+    """
+    Batched point to edge geometry for an (N, 3) cloud and an (E, 2, 3) edge tensor or EdgeGeometry
+    :return: signed distances along each edge's local Y-axis (N, E), projection lengths along the edge (N, E)
+             and, when max_distance is given, the hit mask |distance| < max_distance (N, E)
+    """
+    geometry = _edge_geometry(edges)
+    signed_distances = geometry.signed_distances(points)
+    projection_lengths = geometry.projection_lengths(points)
+    hits = None if max_distance is None else np.abs(signed_distances) < max_distance
+    return signed_distances, projection_lengths, hits
+
+
+def pair_edge_distances(points, edges, point_idx, edge_idx):
+    """point_edge_distances evaluated only for the given (point_idx, edge_idx) pairs, bit-identical to the dense kernel"""
+    geometry = _edge_geometry(edges)
+    pair_points = np.asarray(points, dtype=np.float64)[point_idx]
+    return geometry.signed_distances(pair_points, edge_idx), geometry.projection_lengths(pair_points, edge_idx)
+
+
+def indexed_candidate_pairs(points, edges, max_distance, grid_index):
+    """
+    (point_idx, edge_idx) pairs with |distance| < max_distance, gathered from the grid cells around each edge line
+    instead of testing the whole cloud. Pairs are ordered by point, then edge, like np.nonzero on the dense mask
+    """
+    geometry = _edge_geometry(edges)
+    point_chunks, edge_chunks = [], []
+    for e, (p1, p2) in enumerate(zip(geometry.origins, geometry.ends)):
+        candidates = grid_index.query_slab(p1, p2, max_distance)
+        point_chunks.append(candidates)
+        edge_chunks.append(np.full(len(candidates), e, dtype=np.int64))
+    point_idx = np.concatenate(point_chunks) if point_chunks else np.zeros(0, dtype=np.int64)
+    edge_idx = np.concatenate(edge_chunks) if edge_chunks else np.zeros(0, dtype=np.int64)
+    signed_distances, projection_lengths = pair_edge_distances(points, geometry, point_idx, edge_idx)
+    hits = np.abs(signed_distances) < max_distance
+    order = np.lexsort((edge_idx[hits], point_idx[hits]))
+    return point_idx[hits][order], edge_idx[hits][order], signed_distances[hits][order], projection_lengths[hits][order]
+
+
+def sparse_point_edge_distances(points, edges, max_distance):
+    """Compact (point_idx, edge_idx, distance) arrays of every point-edge pair closer than max_distance"""
+    signed_distances, _, hits = point_edge_distances(points, edges, max_distance)
+    point_idx, edge_idx = np.nonzero(hits)
+    return point_idx, edge_idx, np.abs(signed_distances[point_idx, edge_idx])
 
 
 def distances_from_points_to_frustums(points, frustum_edges, max_distance):
     """Calculate distances of point to edges"""
     point_line_distances = {i: [] for i, point in enumerate(points)}
+    geometry = EdgeGeometry.from_frustum_edges(frustum_edges)
+    if len(points) == 0 or len(geometry) == 0:
+        return point_line_distances
 
-    # Iterate over each point and each line
-    for i, point in enumerate(points):
-        for cam, edges in frustum_edges.items():
-            for edge_idx, edge_points in enumerate(edges):
-                p1, p2 = edge_points
-
-                distance = distance_to_line_along_local_y(point, p1, p2)
-                if distance < max_distance:
-                    point_line_distances[i].append({
-                        'camera': cam, 'edge_idx': edge_idx,
-                        'distance': distance, 'edge_coordinates': edge_points,
-                        'lidar_point': point
-                    })
+    edge_coordinates = [edge_points for cam_edges in frustum_edges.values() for edge_points in cam_edges]
+    point_idx, edge_idx, distances = sparse_point_edge_distances(points, geometry, max_distance)
+    for i, e, distance in zip(point_idx.tolist(), edge_idx.tolist(), distances):
+        point_line_distances[i].append({
+            'camera': geometry.edge_cams[e], 'edge_idx': int(geometry.edge_ids[e]),
+            'distance': distance, 'edge_coordinates': edge_coordinates[e],
+            'lidar_point': points[i]
+        })
 
     return point_line_distances
 
 
+def boundary_strip_pairs(points_xyz, geometry, max_distance, base_threshold, max_threshold, grid_index=None):
+    """
+    (point_idx, edge_idx) strip memberships of one cloud, ordered by point then edge.
+    Every decision only involves a single point, so clouds can be processed in independent chunks
+    """
+    if grid_index is None:
+        grid_index = PointGridIndex(points_xyz)
+    point_idx, edge_idx, distances, projection_lengths = indexed_candidate_pairs(points_xyz, geometry, max_distance,
+                                                                                 grid_index)
+    dynamic_thresholds = geometry.angular_thresholds(points_xyz[point_idx], base_threshold, max_threshold, edge_idx)
+    within_edge = geometry.within_edge(None, edge_idx, projection_lengths=projection_lengths)
+
+    # A point qualifies through any of its candidate edges, then joins every strip it is close enough to
+    qualified = np.zeros(len(points_xyz), dtype=bool)
+    qualified[point_idx[(distances < dynamic_thresholds) & within_edge]] = True
+    keep = qualified[point_idx] & (np.abs(distances) < dynamic_thresholds)
+    return point_idx[keep], edge_idx[keep]
+
+
+def extract_boundary_strips(points, frustum_edges, max_distance, base_threshold, max_threshold, grid_index=None):
+    """
+    Fused boundary strip extraction. Distance, along-edge projection, within-edge test and dynamic threshold are
+    evaluated once per candidate point-edge pair, with the same rules as create_boundary_dict.
+    Candidates come from an XY grid index over the cloud, so cost follows the strip size rather than the cloud size
+    :param frustum_edges: {cam: [(p1, p2), ...]} from extract_top_edges or a prebuilt EdgeGeometry
+    :param grid_index: PointGridIndex over points, built here when not given (reuse it across threshold settings)
+    :return: {strip_name: index array into points} for every non-empty strip
+    """
+    geometry = _edge_geometry(frustum_edges)
+    if len(points) == 0 or len(geometry) == 0:
+        return {}
+
+    points_xyz = np.asarray(points, dtype=np.float64)[:, :3]
+    point_idx, edge_idx = boundary_strip_pairs(points_xyz, geometry, max_distance, base_threshold, max_threshold,
+                                               grid_index)
+    return group_strip_pairs(point_idx, edge_idx, geometry.strip_names)
+
+
+def group_strip_pairs(point_idx, edge_idx, strip_names):
+    """{strip_name: point indices} from (point_idx, edge_idx) memberships ordered by point, strips in edge order"""
+    order = np.argsort(edge_idx, kind='stable')
+    strip_edges, starts = np.unique(edge_idx[order], return_index=True)
+    return {strip_names[e]: indices for e, indices in zip(strip_edges.tolist(), np.split(point_idx[order], starts[1:]))}
+
+
+def iter_point_chunks(points, chunk_size):
+    """Consecutive (chunk_size, C) slices of an array or memory map, only the current slice is materialized"""
+    for start in range(0, len(points), chunk_size):
+        yield np.asarray(points[start:start + chunk_size])
+
+
+def stream_boundary_strips(points, frustum_edges, max_distance, base_threshold, max_threshold, chunk_size=1 << 20):
+    """
+    Bounded-memory extract_boundary_strips for large accumulated clouds. The cloud is consumed chunk by chunk from
+    an array, memory map or any iterable of (M, >=3) blocks (e.g. PointCloudAccumulator.iter_sweeps), blocks larger
+    than chunk_size are split further. Strip members are appended to compact arrays.
+    Peak memory is set by chunk_size plus the strips themselves; the result matches the in-memory path exactly
+    :return: {strip_name: index array into the full cloud}, {strip_name: (K, 3) member coordinates}
+    """
+    geometry = _edge_geometry(frustum_edges)
+    strip_names = geometry.strip_names
+    blocks = [points] if hasattr(points, 'shape') else points
+    chunks = (chunk for block in blocks for chunk in iter_point_chunks(block, chunk_size))
+    index_parts = [[] for _ in range(len(geometry))]
+    point_parts = [[] for _ in range(len(geometry))]
+    offset = 0
+    for chunk in chunks:
+        chunk_xyz = np.asarray(chunk, dtype=np.float64)[:, :3]
+        if len(chunk_xyz) and len(geometry):
+            point_idx, edge_idx = boundary_strip_pairs(chunk_xyz, geometry, max_distance, base_threshold,
+                                                       max_threshold)
+            for e in np.unique(edge_idx).tolist():
+                members = point_idx[edge_idx == e]
+                index_parts[e].append(members + offset)
+                point_parts[e].append(np.asarray(chunk)[members, :3])
+        offset += len(chunk_xyz)
+
+    strip_indices, strip_points = {}, {}
+    for e, strip_name in enumerate(strip_names):
+        if index_parts[e]:
+            strip_indices[strip_name] = np.concatenate(index_parts[e])
+            strip_points[strip_name] = np.concatenate(point_parts[e])
+    return strip_indices, strip_points
+
+
+def analytic_boundary_strips(frustum_edges, spacing=0.5, height=None, max_range=None):
+    """
+    Boundary strips sampled directly from the frustum top edges instead of selected from LiDAR points.
+    The result has the strip_name -> (K, 3) points format of the LiDAR strips, so it projects into the
+    neighbouring cameras through project_own_lidar_to_image_remove_noise / image_creation unchanged
+    :param spacing: distance between samples along each edge in metres
+    :param height: project every sample vertically onto the plane z = height (LiDAR frame), i.e. sample the edge's
+                   footprint on that plane rather than where the edge ray crosses it (a single point)
+    :param max_range: only sample the first max_range metres of each edge from its origin
+    """
+    geometry = _edge_geometry(frustum_edges)
+    strips = {}
+    for e, strip_name in enumerate(geometry.strip_names):
+        length = geometry.lengths[e] if max_range is None else min(geometry.lengths[e], max_range)
+        steps = np.linspace(0.0, length, max(int(np.ceil(length / spacing)) + 1, 2))
+        samples = geometry.origins[e] + steps[:, None] * geometry.directions[e]
+        if height is not None:
+            samples[:, 2] = height
+        strips[strip_name] = samples
+    return strips
+
+
 def create_boundary_dict(point_distance, base_threshold, max_threshold):
     # Dictionary to hold points by strip with dynamic thresholding
     strip_points = defaultdict(list)
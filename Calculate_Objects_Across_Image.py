@@ -45,7 +45,9 @@ def extract_overlap_points(yolov8_data):
 def process_camera_combinations(point_trackers, cameras, detections):
     results_by_center = {}
     for cam in cameras:
-        camera_data = point_trackers.get(cam, [])
+        camera_data = point_trackers.get(cam)
+        if camera_data is None:
+            continue
         closest_points = find_closest_points(camera_data, detections)
         for center, points in closest_points.items():
             if center not in results_by_center:
@@ -59,15 +61,16 @@ def process_camera_combinations(point_trackers, cameras, detections):
 def find_closest_points(camera_data, bounding_boxes):
     results = {}
     threshold = 8  # pixels
+    # Columnar point tracker from tracking_lidar_to_image, used as is for every box
+    image_coords = camera_data['uv']
+    lidar_coords = camera_data['xyz']
 
     for bbox in bounding_boxes:
         center = np.array(bbox[0])  # bbox[0] is the central point of the bounding box
-        image_coords = np.array([data[0] for data in camera_data])
-        lidar_coords = np.array([data[1] for data in camera_data])
 
-        within_threshold = np.abs(image_coords - center) <= threshold
-        filtered_image_coords = image_coords[np.all(within_threshold, axis=1)]
-        filtered_lidar_coords = lidar_coords[np.all(within_threshold, axis=1)]
+        within_threshold = np.all(np.abs(image_coords - center) <= threshold, axis=1)
+        filtered_image_coords = image_coords[within_threshold]
+        filtered_lidar_coords = lidar_coords[within_threshold]
 
         if filtered_image_coords.size > 0:
             distances = np.linalg.norm(filtered_image_coords - center, axis=1)
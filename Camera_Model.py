@@ -0,0 +1,44 @@
+import numpy as np
+
+
+class CameraModel(object):
+    """
+    Immutable calibration of one camera for a whole sequence, shared by every frame of it.
+    Keeps the inverse extrinsics and the 3x4 projection precomputed so no caller has to invert
+    cam_to_velo or stack intrinsics again.
+    """
+    __slots__ = ('cam_name', 'cam_to_velo', 'velo_to_cam', 'intrinsic', 'distortion', 'new_intrinsic',
+                 'projection', 'image_size')
+
+    def __init__(self, cam_name, cam_to_velo, intrinsic, distortion, new_intrinsic, image_size):
+        cam_to_velo = np.array(cam_to_velo, dtype=np.float64)
+        new_intrinsic = np.array(new_intrinsic, dtype=np.float64)
+        velo_to_cam = np.linalg.inv(cam_to_velo)
+        values = {
+            'cam_name': cam_name,
+            'cam_to_velo': cam_to_velo,
+            'velo_to_cam': velo_to_cam,
+            'intrinsic': np.array(intrinsic, dtype=np.float64),
+            'distortion': np.array(distortion, dtype=np.float64),
+            'new_intrinsic': new_intrinsic,
+            # LiDAR homogeneous point -> undistorted image homogeneous point
+            'projection': np.dot(new_intrinsic, velo_to_cam[:3]),
+            'image_size': tuple(image_size),
+        }
+        for name, value in values.items():
+            if isinstance(value, np.ndarray):
+                value.setflags(write=False)
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('CameraModel is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('CameraModel is immutable')
+
+    def __repr__(self):
+        return 'CameraModel({}, image_size={})'.format(self.cam_name, self.image_size)
+
+    def project(self, points_xyz):
+        """(N, 3) LiDAR points -> (N, 3) homogeneous image points, the last column is the camera depth"""
+        return np.dot(points_xyz, self.projection[:, :3].T) + self.projection[:, 3]
@@ -1,4 +1,4 @@
-from Point_Boundary_Seperator import check_point_in_overlaps
+from Point_Boundary_Seperator import classify_overlaps, build_strip_indices
 from General_Utility import check_folder
 from collections import defaultdict
 import numpy as np
@@ -9,16 +9,26 @@ import matplotlib.pyplot as plt
 from matplotlib.cm import get_cmap
 
 
-def bounding_boxes_in_overlap(projected_points_to_images, overlap, data, image_folder_path):
+def bounding_boxes_in_overlap(projected_points_to_images, overlap, data, image_folder_path, render=True, label_map=None,
+                              strip_models=None):
+    """
+    :param strip_models: optional per-camera StripIndex or BoundaryModel, built from the strips when not given
+    :param label_map: optional OverlapLabelMap of this frame, detection centres are then looked up in its
+                      rasterized cells instead of being classified against the strips
+    """
     #print(projected_points_to_images["cam03"])
     colour_palette = define_colours()
 
     data = extract_relevant_data(data)
     save_folder = os.path.join(image_folder_path, "Overlapping_Boxes")
     extraction_folder = os.path.join(image_folder_path, "Undistorted_Images")
-    check_folder(save_folder)
+    if render:
+        check_folder(save_folder)
 
     coordinate_info = []
+    if strip_models is None and label_map is None:
+        strip_models = build_strip_indices(projected_points_to_images)
+    camera_names = list(overlap.keys()) if label_map is None else label_map.camera_names
 
     for names, info in data.items():
         centers, classes, confidences, bounding_boxes = info
@@ -26,14 +36,23 @@ def bounding_boxes_in_overlap(projected_points_to_images, overlap, data, image_f
         image_path = os.path.join(extraction_folder, names)
         colour_mapping = {}
         colours = []
+        # Every detection centre of the image is classified in one batched call
+        centre_points = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+        if label_map is not None:
+            overlap_matrix = label_map.overlap_matrix(cam_name, centre_points)
+        else:
+            overlap_matrix = classify_overlaps(cam_name, centre_points, strip_models[cam_name], overlap, camera_names)
         for index, centre in enumerate(centers):
-            centre = [[centre[0], centre[1]]]
             new_info = [centers[index], classes[index], confidences[index], bounding_boxes[index]]
-            details, overlap_dict = check_point_in_overlaps(cam_name, centre, projected_points_to_images[cam_name], overlap)
+            overlap_cams = [camera_names[c] for c in np.nonzero(overlap_matrix[index])[0]]
+            overlap_dict = {(centre[0], centre[1]): (cam_name, overlap_cams)}
             coordinate_info.append((overlap_dict, new_info))
-            colour = get_colour_for_overlap(overlap_dict, colour_palette, colour_mapping)
-            colours.append(colour)
+            if render:
+                colour = get_colour_for_overlap(overlap_dict, colour_palette, colour_mapping)
+                colours.append(colour)
 
+        if not render:
+            continue
         annotated_image = draw_bounding_boxes(image_path, bounding_boxes, colours, classes, confidences)
         if annotated_image is not None:
             annotated_image = draw_legend(annotated_image, colour_mapping, colour_palette, cam_name)
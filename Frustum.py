@@ -1,6 +1,18 @@
+import hashlib
+import os
 import numpy as np
 import matplotlib.pyplot as plt
 import open3d as o3d
+
+# Overlap graphs only depend on calibration, memoized by calibration hash
+_overlap_graph_cache = {}
+# Pairwise footprint intersection polygons, memoized by frustum geometry and height bands
+_overlap_polygon_cache = {}
+
+# Corner index pairs of the 12 frustum edges (near ring, far ring, near to far)
+FRUSTUM_EDGE_PAIRS = [(i, (i + 1) % 4) for i in range(4)] + [(i + 4, (i + 1) % 4 + 4) for i in range(4)] + \
+                     [(i, i + 4) for i in range(4)]
+
 def calculate_frustum_corners(cam_intrinsics, cam_to_velo, near, far):
     """ Calculates the frustum corners of the camera using intrinsics and extrinsic parameters. """
     # Extracing the focal lengths and the coordinates of the optical centre
@@ -51,57 +63,233 @@ def return_frustums(list):
     return frustum_dict, top_edges
 
 
-def project_frustum_to_image(cam_intrinsics, cam_to_velo, frustum_dict, image_width, image_height):
+def project_frustum_to_image(cam_intrinsics, cam_to_velo, frustum_dict, image_width, image_height, camera_models=None):
+    """camera_models (ONCE.get_camera_models) provide precomputed projections instead of inverting cam_to_velo"""
+    cam_names = list(frustum_dict.keys())
+    projections = stack_projections(cam_names, cam_intrinsics, cam_to_velo, camera_models)
+    corners = np.stack([np.asarray(frustum_dict[cam_name])[:, :3] for cam_name in cam_names])
+    _, corner_counts = compute_overlap_matrix(projections, corners, image_width, image_height)
+    return overlap_matrix_to_dict(cam_names, corner_counts)
+
+
+def stack_projections(cam_names, cam_intrinsics, cam_to_velo, camera_models=None):
+    """(C, 3, 4) LiDAR to image projections in cam_names order"""
+    if camera_models is not None:
+        return np.stack([camera_models[cam_name].projection for cam_name in cam_names])
+    return np.stack([np.dot(cam_intrinsics[cam_name], np.linalg.inv(cam_to_velo[cam_name])[:3])
+                     for cam_name in cam_names])
+
+
+def calibration_hash(projections, corners, image_width, image_height):
+    digest = hashlib.md5(np.ascontiguousarray(projections, dtype=np.float64).tobytes())
+    digest.update(np.ascontiguousarray(corners, dtype=np.float64).tobytes())
+    digest.update('{}x{}'.format(image_width, image_height).encode())
+    return digest.hexdigest()
+
+
+def compute_overlap_matrix(projections, corners, image_width, image_height, vertical_slack=5000):
+    """
+    Project the corners of every frustum into every camera at once.
+    corner_counts[s, t] is the number of corners of frustum t landing in camera s (within the vertical slack),
+    adjacency[s, t] is True when camera s sees frustum t, or when t sees more than 4 corners of s
+    :param projections: (C, 3, 4) projections, see stack_projections
+    :param corners: (C, 8, 3) frustum corners in the same camera order
+    :return: adjacency (C, C) bool, corner_counts (C, C) int
+    """
+    key = (calibration_hash(projections, corners, image_width, image_height), vertical_slack)
+    if key in _overlap_graph_cache:
+        return _overlap_graph_cache[key]
+
+    num_cams = projections.shape[0]
+    points = corners.reshape(-1, 3)
+    points_img = np.einsum('sij,nj->sni', projections[:, :, :3], points) + projections[:, None, :, 3]
+    depth = points_img[..., 2]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        u = points_img[..., 0] / depth
+        v = points_img[..., 1] / depth
+    inside = (depth > 0) & (u >= 0) & (u < image_width) & (v >= -vertical_slack) & (v < image_height + vertical_slack)
+    corner_counts = inside.reshape(num_cams, num_cams, -1).sum(axis=2)
+    np.fill_diagonal(corner_counts, 0)  # Avoid self-counting
+    adjacency = (corner_counts > 0) | (corner_counts > 4).T
+
+    # shared by every frame with the same calibration, callers must not edit them
+    adjacency.setflags(write=False)
+    corner_counts.setflags(write=False)
+    _overlap_graph_cache[key] = (adjacency, corner_counts)
+    return adjacency, corner_counts
+
+
+def overlap_matrix_to_dict(cam_names, corner_counts):
+    """Overlap dict in the historical project_frustum_to_image format, refine_overlaps applied"""
     overlap_dict = {}
-    point_dictionary = {}  # New dictionary for counting overlapping points
-    points_list = []
-    points_cam_map = []  # List to keep track of which points belong to which camera
-
-    # Collect all points into a single list while keeping track of their source camera
-    for cam_name, points in frustum_dict.items():
-        points_list.extend(points)
-        points_cam_map.extend([cam_name] * len(points))  # Repeat cam_name for each point
-
-    points_list = np.array(points_list)
-
-    # Iterate through each camera as the source of the frustum points
-    for source_cam_id, frustum_corners in frustum_dict.items():
-        overlap_dict[source_cam_id] = []
-        point_dictionary[source_cam_id] = {}  # Initialize for point counting
-
-        source_intrinsics = cam_intrinsics[source_cam_id]
-        source_cam_to_velo = cam_to_velo[source_cam_id]
-
-        cam_intri = np.hstack([source_intrinsics, np.zeros((3, 1))])
-        point_xyz = points_list[:, :3]
-        points_homo = np.hstack(
-            [point_xyz, np.ones(point_xyz.shape[0], dtype=np.float32).reshape((-1, 1))])
-        points_lidar = np.dot(points_homo, np.linalg.inv(source_cam_to_velo).T)
-        mask = points_lidar[:, 2] > 0
-        points_lidar = points_lidar[mask]
-        points_cam_map_filtered = [points_cam_map[i] for i, m in enumerate(mask) if m]
-
-        points_img = np.dot(points_lidar, cam_intri.T)
-        points_img = points_img / points_img[:, [2]]
-
-        # Check if points are within the image bounds and record overlaps
-        for point, cam_id in zip(points_img, points_cam_map_filtered):
-            if 0 <= point[0] < image_width and -5000 <= point[1] < image_height + 5000:
-                if cam_id != source_cam_id:  # Avoid self-counting
-                    # Update the list in overlap_dict
-                    if cam_id not in overlap_dict[source_cam_id]:
-                        overlap_dict[source_cam_id].append(cam_id)
-
-                    # Count the points in point_dictionary
-                    if cam_id in point_dictionary[source_cam_id]:
-                        point_dictionary[source_cam_id][cam_id] += 1
-                    else:
-                        point_dictionary[source_cam_id][cam_id] = 1
-
-    overlap_dict = refine_overlaps(overlap_dict, point_dictionary)
-
-    return overlap_dict
-
+    point_dictionary = {}
+    for s, source_cam_id in enumerate(cam_names):
+        overlap_dict[source_cam_id] = [cam_id for t, cam_id in enumerate(cam_names) if corner_counts[s, t] > 0]
+        point_dictionary[source_cam_id] = {cam_id: int(corner_counts[s, t])
+                                           for t, cam_id in enumerate(cam_names) if corner_counts[s, t] > 0}
+    return refine_overlaps(overlap_dict, point_dictionary)
+
+
+def precompute_sequence_overlap(dataset, seq_id, cam_names, near_plane, far_plane, image_width, image_height,
+                                cache_dir=None):
+    """
+    Overlap graph of a whole sequence from its calibration, persisted next to the dataset
+    (<dataset_root>/overlap_cache/<seq_id>.npz by default) and reused while the calibration hash matches
+    :return: overlap_dict, adjacency (C, C), corner_counts (C, C) in cam_names order
+    """
+    camera_models = dataset.get_camera_models(seq_id, (image_width, image_height))
+    frustum_dict = {cam_name: calculate_frustum_corners(camera_models[cam_name].new_intrinsic,
+                                                        camera_models[cam_name].cam_to_velo, near_plane, far_plane)
+                    for cam_name in cam_names}
+    projections = stack_projections(cam_names, None, None, camera_models)
+    corners = np.stack([frustum_dict[cam_name] for cam_name in cam_names])
+    calib_hash = calibration_hash(projections, corners, image_width, image_height)
+
+    if cache_dir is None:
+        cache_dir = os.path.join(dataset.dataset_root, 'overlap_cache')
+    cache_path = os.path.join(cache_dir, '{}.npz'.format(seq_id))
+    if os.path.isfile(cache_path):
+        cached = np.load(cache_path)
+        if str(cached['calib_hash']) == calib_hash and list(cached['cam_names']) == list(cam_names):
+            adjacency, corner_counts = cached['adjacency'], cached['corner_counts']
+            adjacency.setflags(write=False)
+            corner_counts.setflags(write=False)
+            _overlap_graph_cache[(calib_hash, 5000)] = (adjacency, corner_counts)
+            return overlap_matrix_to_dict(cam_names, corner_counts), adjacency, corner_counts
+
+    adjacency, corner_counts = compute_overlap_matrix(projections, corners, image_width, image_height)
+    os.makedirs(cache_dir, exist_ok=True)
+    np.savez(cache_path, cam_names=np.array(cam_names), adjacency=adjacency, corner_counts=corner_counts,
+             calib_hash=np.array(calib_hash))
+    return overlap_matrix_to_dict(cam_names, corner_counts), adjacency, corner_counts
+
+
+def _cross_2d(a, b):
+    """z component of the cross product of 2-D vectors (np.cross on 2-D vectors is deprecated)"""
+    return a[..., 0] * b[..., 1] - a[..., 1] * b[..., 0]
+
+
+def convex_hull_2d(points):
+    """Counter-clockwise convex hull (monotone chain) of (N, 2) points, collinear points dropped"""
+    points = np.unique(np.asarray(points, dtype=np.float64), axis=0)
+    if len(points) < 3:
+        return points
+
+    def build(sequence):
+        hull = []
+        for point in sequence:
+            while len(hull) >= 2 and _cross_2d(hull[-1] - hull[-2], point - hull[-2]) <= 1e-12:
+                hull.pop()
+            hull.append(point)
+        return hull
+
+    lower = build(points)
+    upper = build(points[::-1])
+    return np.array(lower[:-1] + upper[:-1])
+
+
+def frustum_footprint(corners, height=0.0):
+    """Convex polygon (K, 2) where the frustum volume crosses the plane z = height, empty when it does not"""
+    corners = np.asarray(corners, dtype=np.float64)
+    starts = corners[[a for a, _ in FRUSTUM_EDGE_PAIRS]]
+    ends = corners[[b for _, b in FRUSTUM_EDGE_PAIRS]]
+    dz = ends[:, 2] - starts[:, 2]
+    crossing = ((starts[:, 2] - height) * (ends[:, 2] - height) <= 0) & (dz != 0)
+    t = (height - starts[crossing, 2]) / dz[crossing]
+    section = starts[crossing, :2] + t[:, None] * (ends[crossing, :2] - starts[crossing, :2])
+    on_plane = corners[corners[:, 2] == height, :2]
+    return convex_hull_2d(np.vstack([section, on_plane]))
+
+
+def clip_convex_polygon(subject, clip):
+    """Sutherland-Hodgman intersection of two counter-clockwise convex polygons"""
+    output = [np.asarray(point, dtype=np.float64) for point in subject]
+    clip = np.asarray(clip, dtype=np.float64)
+    for i in range(len(clip)):
+        if not output:
+            break
+        edge_start, edge_end = clip[i], clip[(i + 1) % len(clip)]
+        edge = edge_end - edge_start
+        inputs, output = output, []
+        for j in range(len(inputs)):
+            current, previous = inputs[j], inputs[j - 1]
+            current_in = _cross_2d(edge, current - edge_start) >= 0
+            previous_in = _cross_2d(edge, previous - edge_start) >= 0
+            if current_in != previous_in:
+                direction = current - previous
+                denom = _cross_2d(edge, direction)
+                t = _cross_2d(edge_start - previous, edge) / -denom if denom != 0 else 0.0
+                output.append(previous + t * direction)
+            if current_in:
+                output.append(current)
+    if len(output) < 3:
+        return np.zeros((0, 2))
+    return convex_hull_2d(np.array(output))
+
+
+def compute_overlap_polygons(frustum_dict, heights=(0.0,)):
+    """
+    Exact intersection of every camera pair's frustum footprint on the planes z = h (LiDAR frame).
+    Computed once per frustum geometry and height bands.
+    :return: dict with 'heights', 'footprints' {cam: [polygon per height]} and
+             'polygons' {(cam_a, cam_b): [polygon per height]} for pairs that intersect at some height
+    """
+    cam_names = list(frustum_dict.keys())
+    heights = np.asarray(heights, dtype=np.float64)
+    digest = hashlib.md5(heights.tobytes())
+    for cam_name in cam_names:
+        digest.update(cam_name.encode())
+        digest.update(np.ascontiguousarray(frustum_dict[cam_name], dtype=np.float64).tobytes())
+    key = digest.hexdigest()
+    if key in _overlap_polygon_cache:
+        return _overlap_polygon_cache[key]
+
+    footprints = {cam_name: [frustum_footprint(frustum_dict[cam_name], h) for h in heights] for cam_name in cam_names}
+    polygons = {}
+    for a, cam_a in enumerate(cam_names):
+        for cam_b in cam_names[a + 1:]:
+            pair_polygons = [clip_convex_polygon(footprints[cam_a][k], footprints[cam_b][k])
+                             if len(footprints[cam_a][k]) >= 3 and len(footprints[cam_b][k]) >= 3 else np.zeros((0, 2))
+                             for k in range(len(heights))]
+            if any(len(polygon) >= 3 for polygon in pair_polygons):
+                polygons[(cam_a, cam_b)] = pair_polygons
+
+    overlap_model = {'heights': heights, 'footprints': footprints, 'polygons': polygons}
+    _overlap_polygon_cache[key] = overlap_model
+    return overlap_model
+
+
+def points_in_convex_polygon(points_xy, polygon):
+    """Vectorized inside test of (N, 2) points against a counter-clockwise convex polygon"""
+    points_xy = np.asarray(points_xy, dtype=np.float64)
+    if len(polygon) < 3:
+        return np.zeros(len(points_xy), dtype=bool)
+    edges = np.roll(polygon, -1, axis=0) - polygon
+    relative = points_xy[:, None, :] - polygon[None, :, :]
+    cross = edges[None, :, 0] * relative[:, :, 1] - edges[None, :, 1] * relative[:, :, 0]
+    return np.all(cross >= 0, axis=1)
+
+
+def points_in_overlap_polygons(points, overlap_model):
+    """
+    Overlap membership of a whole cloud, every point tested against the polygons of its nearest height band
+    :return: list of camera pairs and an (N, P) boolean membership matrix in that order
+    """
+    points = np.asarray(points)
+    heights = overlap_model['heights']
+    if len(heights) > 1:
+        band = np.digitize(points[:, 2], (heights[1:] + heights[:-1]) / 2) if np.all(np.diff(heights) > 0) else \
+            np.argmin(np.abs(points[:, 2, None] - heights[None, :]), axis=1)
+    else:
+        band = np.zeros(len(points), dtype=int)
+    pair_names = list(overlap_model['polygons'].keys())
+    membership = np.zeros((len(points), len(pair_names)), dtype=bool)
+    for p, pair in enumerate(pair_names):
+        for k, polygon in enumerate(overlap_model['polygons'][pair]):
+            in_band = np.nonzero(band == k)[0]
+            if len(polygon) >= 3 and len(in_band):
+                membership[in_band, p] = points_in_convex_polygon(points[in_band, :2], polygon)
+    return pair_names, membership
 
 
 def refine_overlaps(overlap_dict, point_dictionary):
@@ -51,7 +51,12 @@ def visualize_coloured_frustums_with_point_cloud(lidar_points, point_colours, fr
     return frustum_line_equations
 
 
-def image_creation(seq, frame, frust_ums, save_location, dataset):
+def image_creation(seq, frame, frust_ums, save_location, dataset, render=True):
+    if not render:
+        # Headless: only the projected strip coordinates are needed, no overlay is drawn or written
+        _, info = dataset.project_own_lidar_to_image_remove_noise(seq, frame, frust_ums, render=False)
+        return info
+
     save_location = os.path.join(save_location, "Overlap_Boundaries")
     if not os.path.exists(save_location):
         os.makedirs(save_location)
@@ -2,9 +2,10 @@ import cv2
 from General_Utility import check_folder
 import os
 
-def extract_points(dataset, seq_id, frame_id, save_folder):
-    img_buf_dict, point_trackers = dataset.tracking_lidar_to_image(seq_id, frame_id)
-    plot_images(img_buf_dict, save_folder, seq_id, frame_id)
+def extract_points(dataset, seq_id, frame_id, save_folder, render=True):
+    img_buf_dict, point_trackers = dataset.tracking_lidar_to_image(seq_id, frame_id, render=render)
+    if render:
+        plot_images(img_buf_dict, save_folder, seq_id, frame_id)
     return point_trackers
 
 def plot_images(image_dict, save_folder, seq_id, frame_id):
@@ -8,7 +8,7 @@ def load_and_save_images(dataset, seq_id, frame_id, image_folder, cams):
     check_folder(image_folder)
 
     try:
-        undistorted_images, _ = dataset.undistort_image_v2(seq_id, frame_id)
+        undistorted_images, _ = dataset.undistort_image_v2(seq_id, frame_id, writable=False)
     except Exception as e:
         print(f"Error loading undistorted images: {e}")
         return {}
@@ -3,9 +3,223 @@ import matplotlib.pyplot as plt
 from matplotlib.cm import get_cmap
 from collections import Counter, defaultdict
 
+
+class StripIndex(object):
+    """
+    Boundary strips projected into one camera, from one entry of projected_points_to_images.
+    Camera ids are parsed once and every strip keeps its points sorted by y, so the closest point
+    by y is a binary search. Ties resolve to the earliest point in the original strip list.
+    """
+
+    def __init__(self, strips):
+        grouped = {}
+        for strip_id, point in strips:
+            grouped.setdefault(strip_id, []).append(point)
+        self.strip_ids = list(grouped.keys())
+        self.strip_cameras = [strip_id.split('_')[0] for strip_id in self.strip_ids]
+        self.cameras = set(self.strip_cameras)
+        self._positions = {strip_id: s for s, strip_id in enumerate(self.strip_ids)}
+        self._points, self._orders, self._xs, self._ys = [], [], [], []
+        for points in grouped.values():
+            ys = np.asarray([point[1] for point in points])
+            order = np.argsort(ys, kind='stable')
+            self._points.append([points[i] for i in order])
+            self._orders.append(order)
+            self._xs.append(np.asarray([point[0] for point in points])[order])
+            self._ys.append(ys[order])
+
+    def __len__(self):
+        return len(self.strip_ids)
+
+    def _closest_positions(self, s, query_ys):
+        """Sorted position of the closest point by y in strip s for every query y"""
+        ys = self._ys[s]
+        query_ys = np.asarray(query_ys)
+        above = np.searchsorted(ys, query_ys, side='left')
+        below = np.searchsorted(ys, ys[np.maximum(above - 1, 0)], side='left')
+        has_above = above < len(ys)
+        has_below = above > 0
+        above_diff = np.where(has_above, np.abs(ys[np.minimum(above, len(ys) - 1)] - query_ys), np.inf)
+        below_diff = np.where(has_below, np.abs(ys[below] - query_ys), np.inf)
+        # Stable sort puts the earliest of equal ys first in each run, a tie between both sides goes to list order
+        orders = self._orders[s]
+        take_below = (below_diff < above_diff) | \
+            ((below_diff == above_diff) & has_below & (orders[below] < orders[np.minimum(above, len(ys) - 1)]))
+        return np.where(take_below, below, above)
+
+    def boundary_x(self, strip_id, ys):
+        """x of the strip point closest by y to each of ys, NaN when the strip is not in this camera"""
+        ys = np.asarray(ys)
+        s = self._positions.get(strip_id)
+        if s is None:
+            return np.full(ys.shape, np.nan)
+        return self._xs[s][self._closest_positions(s, ys.ravel())].reshape(ys.shape)
+
+    def find_closest_point_by_y(self, query_points, valid_cameras=None):
+        """Same output as find_closest_point_by_y on the strips of valid_cameras"""
+        query_ys = np.asarray([query_point[1] for query_point in query_points])
+        strips = [s for s, cam in enumerate(self.strip_cameras) if valid_cameras is None or cam in valid_cameras]
+        closest = {s: self._closest_positions(s, query_ys) for s in strips}
+        return [[(self.strip_ids[s], self._points[s][closest[s][q]], query_point) for s in strips]
+                for q, query_point in enumerate(query_points)]
+
+
+def as_strip_index(strips):
+    """Prebuilt StripIndex or any model with its interface (e.g. Boundary_Smoothing.BoundaryModel) as is, else index"""
+    return strips if hasattr(strips, 'boundary_x') else StripIndex(strips)
+
+
+def build_strip_indices(projected_points_to_images):
+    """One StripIndex per camera, built once per frame and reused for every query"""
+    return {cam_name: StripIndex(strips) for cam_name, strips in projected_points_to_images.items()}
+
+
+def _valid_strip_matrix(camera_id, query_points, strip_index, overlap, allowed_failures):
+    """
+    Vectorized find_closest_point_by_y, check_relative_x_position and validate_overlap_conditions
+    :return: (M, S) validity of every checked strip per query point, the checked strip positions and missing cameras
+    """
+    valid_cameras = overlap.get(camera_id, [])
+    missing_cameras = [cam for cam in valid_cameras if cam not in strip_index.cameras]
+    query_points = np.asarray(query_points).reshape(-1, 2)
+    query_x, query_y = query_points[:, 0], query_points[:, 1]
+
+    strips = [s for s, cam in enumerate(strip_index.strip_cameras) if cam in valid_cameras]
+    closest_x = {s: strip_index.boundary_x(strip_index.strip_ids[s], query_y) for s in strips}
+    bounds = defaultdict(dict)
+    for s in strips:
+        bounds[strip_index.strip_cameras[s]][strip_index.strip_ids[s].split('_')[-1]] = closest_x[s]
+
+    within = np.zeros((len(query_points), len(strips)), dtype=bool)
+    for j, s in enumerate(strips):
+        cam_bounds = bounds[strip_index.strip_cameras[s]]
+        strip_type = strip_index.strip_ids[s].split('_')[-1]
+        if 'strip0' in cam_bounds and 'strip1' in cam_bounds:
+            # Both boundaries are present, the query point has to lie between them
+            left_bound = np.minimum(cam_bounds['strip0'], cam_bounds['strip1'])
+            right_bound = np.maximum(cam_bounds['strip0'], cam_bounds['strip1'])
+            within[:, j] = (left_bound <= query_x) & (query_x <= right_bound)
+        elif strip_type == 'strip0':
+            within[:, j] = query_x >= closest_x[s]
+        elif strip_type == 'strip1':
+            within[:, j] = query_x <= closest_x[s]
+
+    # Every strip is checked once per query point, so it fails at most once
+    return (~within).astype(int) <= allowed_failures, strips, missing_cameras
+
+
+def classify_overlaps(camera_id, query_points, strips, overlap, camera_names=None, query_type='point',
+                      return_messages=False):
+    """
+    Batched check_point_in_overlaps for all query points (detection centres or box corners) of one camera
+    :param query_points: (M, 2) image points
+    :param strips: projected strip points of camera_id as [(strip_id, point), ...], a StripIndex or a BoundaryModel
+    :param camera_names: matrix columns, defaults to the cameras of overlap
+    :param query_type: 'point' (no failed strip allowed) or 'box' (one failure allowed), as check_point_in_overlaps
+    :param return_messages: also return the human-readable sentence of every query point
+    :return: (M, N_cam) boolean overlap matrix[, messages]
+    """
+    strip_index = as_strip_index(strips)
+    camera_names = list(overlap.keys()) if camera_names is None else list(camera_names)
+    allowed_failures = {'point': 0, 'box': 1}[query_type]
+    valid, checked_strips, missing_cameras = _valid_strip_matrix(camera_id, query_points, strip_index, overlap,
+                                                                 allowed_failures)
+
+    columns = {cam: c for c, cam in enumerate(camera_names)}
+    overlap_matrix = np.zeros((len(valid), len(camera_names)), dtype=bool)
+    for j, s in enumerate(checked_strips):
+        if strip_index.strip_cameras[s] in columns:
+            overlap_matrix[:, columns[strip_index.strip_cameras[s]]] |= valid[:, j]
+    for cam in missing_cameras:
+        if cam in columns:
+            overlap_matrix[:, columns[cam]] = True
+
+    if not return_messages:
+        return overlap_matrix
+    all_valid_strips = [[strip_index.strip_ids[checked_strips[j]] for j in np.nonzero(row)[0]] for row in valid]
+    query_list = query_points.tolist() if isinstance(query_points, np.ndarray) else [list(p) for p in query_points]
+    messages, _ = compile_results(all_valid_strips, query_list, camera_id, query_type, missing_cameras)
+    return overlap_matrix, messages
+
+
+class OverlapLabelMap(object):
+    """
+    Per-camera overlap bitmasks rasterized on a grid of downsample x downsample pixel cells.
+    Bit c of a cell is set when its centre overlaps camera_names[c] according to classify_overlaps, so the
+    strip0/strip1 fill follows the projected strip polylines. Build it once per frame, or once per calibration
+    while strips are stable. Point queries are then array lookups and box fractions come from integral images.
+    strip_indices may hold prebuilt per-camera StripIndex or BoundaryModel objects.
+    """
+
+    def __init__(self, projected_points_to_images, overlap, image_size=(1920, 1020), downsample=4, camera_names=None,
+                 strip_indices=None):
+        self.camera_names = list(overlap.keys()) if camera_names is None else list(camera_names)
+        self.image_size = image_size
+        self.downsample = downsample
+        self.shape = (-(-image_size[1] // downsample), -(-image_size[0] // downsample))
+        self.dtype = np.uint8 if len(self.camera_names) <= 8 else np.uint16 if len(self.camera_names) <= 16 else \
+            np.uint32
+        if strip_indices is None:
+            strip_indices = build_strip_indices(projected_points_to_images)
+
+        rows, cols = np.indices(self.shape)
+        cell_centres = np.stack([(cols.ravel() + 0.5) * downsample, (rows.ravel() + 0.5) * downsample], axis=1)
+        bits = (1 << np.arange(len(self.camera_names))).astype(self.dtype)
+        self.labels = {}
+        for cam_name, strip_index in strip_indices.items():
+            overlap_matrix = classify_overlaps(cam_name, cell_centres, strip_index, overlap, self.camera_names)
+            self.labels[cam_name] = np.bitwise_or.reduce(np.where(overlap_matrix, bits, 0).astype(self.dtype),
+                                                         axis=1).reshape(self.shape)
+        self._integrals = {}
+
+    def _cells(self, points):
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        cols = np.clip(np.floor(points[:, 0] / self.downsample).astype(np.int64), 0, self.shape[1] - 1)
+        rows = np.clip(np.floor(points[:, 1] / self.downsample).astype(np.int64), 0, self.shape[0] - 1)
+        return rows, cols
+
+    def lookup(self, cam_name, points):
+        """Overlap bitmask of the cell holding each (M, 2) point, points outside the image use the nearest cell"""
+        rows, cols = self._cells(points)
+        return self.labels[cam_name][rows, cols]
+
+    def overlap_matrix(self, cam_name, points):
+        """(M, N_cam) boolean matrix in camera_names order, like classify_overlaps"""
+        masks = self.lookup(cam_name, points)
+        return (masks[:, None] >> np.arange(len(self.camera_names)).astype(self.dtype)) & 1 == 1
+
+    def decode(self, mask):
+        return [cam for c, cam in enumerate(self.camera_names) if int(mask) >> c & 1]
+
+    def _integral(self, cam_name):
+        """Summed-area tables (N_cam, rows + 1, cols + 1) of every camera bit"""
+        if cam_name not in self._integrals:
+            labels = self.labels[cam_name]
+            planes = (labels[None] >> np.arange(len(self.camera_names)).astype(self.dtype)[:, None, None]) & 1
+            integral = np.zeros((len(self.camera_names), self.shape[0] + 1, self.shape[1] + 1), dtype=np.int32)
+            integral[:, 1:, 1:] = planes.cumsum(axis=1).cumsum(axis=2)
+            self._integrals[cam_name] = integral
+        return self._integrals[cam_name]
+
+    def box_fractions(self, cam_name, boxes):
+        """
+        Fraction of the cells covered by each (x1, y1, x2, y2) box that overlap each camera
+        :return: (B, N_cam) float array in camera_names order
+        """
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        row0, col0 = self._cells(np.minimum(boxes[:, :2], boxes[:, 2:]))
+        row1, col1 = self._cells(np.maximum(boxes[:, :2], boxes[:, 2:]))
+        row1, col1 = row1 + 1, col1 + 1
+        integral = self._integral(cam_name)
+        counts = integral[:, row1, col1] - integral[:, row0, col1] - integral[:, row1, col0] + integral[:, row0, col0]
+        return (counts / ((row1 - row0) * (col1 - col0))).T
+
+
 def check_point_in_overlaps(camera_id, query_points, strips, overlap):
-    # Retrieve strip data for the specified camera
-    strip_data, missing_cameras = get_strip_data_for_camera(camera_id, strips, overlap, query_points)
+    """
+    :param strips: projected strip points of camera_id as [(strip_id, point), ...], a StripIndex or a BoundaryModel
+    """
+    strip_index = as_strip_index(strips)
 
     # Determine if the input is a single point or a bounding box
     if len(query_points) == 1:
@@ -16,19 +230,16 @@ def check_point_in_overlaps(camera_id, query_points, strips, overlap):
         raise ValueError(
             "Invalid number of points provided. Must be either one point or four points for a bounding box.")
 
-    # Find the closest points by Y-coordinate for each query point
-    all_closest_points = find_closest_point_by_y(query_points, strip_data)
-
-    # Check relative X positions based on overlap direction
-    all_x_position_results = check_relative_x_position(all_closest_points)
-
     # Validate overlap conditions based on the type of query
     if query_type == 'point':
         valid_box = "zero"  # Strictest setting for a single point
     else:  # Assuming 'box' type
         valid_box = "one"  # Allowing some flexibility for bounding boxes
+    allowed_failures = {"zero": 0, "one": 1, "two": 2}[valid_box]
 
-    all_valid_strips = validate_overlap_conditions(all_x_position_results, valid_box)
+    valid, checked_strips, missing_cameras = _valid_strip_matrix(camera_id, query_points, strip_index, overlap,
+                                                                 allowed_failures)
+    all_valid_strips = [[strip_index.strip_ids[checked_strips[j]] for j in np.nonzero(row)[0]] for row in valid]
 
     # Compile and return results
     final_results = compile_results(all_valid_strips, query_points, camera_id, query_type, missing_cameras)
@@ -0,0 +1,162 @@
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+
+def voxel_keys(points_xyz, voxel_size):
+    """Pack the integer voxel coordinates of every point into one int64 key (21 bits per axis)"""
+    voxel_coords = np.floor(points_xyz / voxel_size).astype(np.int64) + (1 << 20)
+    return (voxel_coords[:, 0] << 42) | (voxel_coords[:, 1] << 21) | voxel_coords[:, 2]
+
+
+def deduplicate_voxels(points, voxel_size, seen_keys=None):
+    """
+    Keep the first point of every occupied voxel, earlier sweeps in the buffer take priority.
+    With seen_keys (sorted keys of voxels already kept from earlier sweeps) those voxels are dropped as well
+    :return: kept points, plus the updated sorted key set when seen_keys is given
+    """
+    unique_keys, first_idx = np.unique(voxel_keys(points[:, :3], voxel_size), return_index=True)
+    if seen_keys is None:
+        return points[np.sort(first_idx)]
+    new_voxels = ~np.isin(unique_keys, seen_keys, assume_unique=True)
+    return points[np.sort(first_idx[new_voxels])], np.union1d(seen_keys, unique_keys[new_voxels])
+
+
+class PointCloudAccumulator(object):
+    """
+    Aggregates consecutive sweeps of one sequence into a single (M, 4) float32 cloud.
+    Coordinates follow frame_concat (world orientation, first frame of the window at the origin)
+    unless in_sensor_frame is set, then they are expressed in the LiDAR frame of the window's
+    first sweep so the sequence calibration applies to the whole cloud.
+    Calling accumulate for overlapping windows reuses the sweeps already transformed for the previous window.
+    With voxel_size every sweep is de-duplicated against the voxels kept so far as it is added, so only the
+    de-duplicated cloud is held; such windows are rebuilt each call since dropped points depend on earlier sweeps.
+    """
+
+    def __init__(self, dataset, seq_id, window_size, voxel_size=None, num_workers=4, in_sensor_frame=False):
+        self.dataset = dataset
+        self.seq_id = seq_id
+        self.window_size = window_size
+        self.voxel_size = voxel_size
+        self.num_workers = num_workers
+        self.in_sensor_frame = in_sensor_frame
+        self._previous = None
+
+    def _window_frames(self, frame_id):
+        frame_list = self.dataset._get_seq_info(self.seq_id)['frame_list']
+        start_idx = frame_list.index(frame_id)
+        return frame_list[start_idx:start_idx + self.window_size]
+
+    def _window_poses(self, frame_ids):
+        """float32 rotations (F, 3, 3) and translations (F, 3) taking each sweep into the window reference"""
+        rotations, translations = self.dataset.get_frame_poses(self.seq_id, frame_ids)
+        # Batched pose transforms relative to the first sweep of the window
+        translations = translations - translations[0]
+        if self.in_sensor_frame:
+            reference_inv = rotations[0].T
+            rotations = np.einsum('ij,fjk->fik', reference_inv, rotations)
+            translations = np.dot(translations, reference_inv.T)
+        return rotations.astype(np.float32), translations.astype(np.float32)
+
+    def _transform_sweep(self, frame_id, rotation, translation, out=None):
+        points = self.dataset.load_point_cloud(self.seq_id, frame_id)
+        if out is None:
+            out = np.empty(points.shape, dtype=np.float32)
+        np.matmul(points[:, :3], rotation.T, out=out[:, :3])
+        out[:, :3] += translation
+        out[:, 3] = points[:, 3]
+        return out
+
+    def iter_sweeps(self, frame_id):
+        """
+        Transformed sweeps of the window starting at frame_id, one (N_i, 4) array at a time, voxel de-duplicated
+        against the earlier sweeps when voxel_size is set. At most num_workers sweeps are in memory at once
+        """
+        frame_ids = self._window_frames(frame_id)
+        try:
+            rotations, translations = self._window_poses(frame_ids)
+        except (ValueError, TypeError):
+            print('warning: part of the frames have no available pose information, return first frame point instead')
+            yield np.array(self.dataset.load_point_cloud(self.seq_id, frame_id))
+            return
+
+        seen_keys = np.zeros(0, dtype=np.int64)
+        batch_size = max(self.num_workers, 1)
+        executor = ThreadPoolExecutor(max_workers=self.num_workers) if self.num_workers > 1 else None
+        try:
+            for start in range(0, len(frame_ids), batch_size):
+                batch = range(start, min(start + batch_size, len(frame_ids)))
+                transform = lambda i: self._transform_sweep(frame_ids[i], rotations[i], translations[i])
+                sweeps = list(executor.map(transform, batch)) if executor is not None and len(batch) > 1 else \
+                    [transform(i) for i in batch]
+                for sweep in sweeps:
+                    if self.voxel_size is not None:
+                        sweep, seen_keys = deduplicate_voxels(sweep, self.voxel_size, seen_keys)
+                    yield sweep
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+    def accumulate(self, frame_id):
+        """
+        Accumulated (M, 4) cloud of the window starting at frame_id. Without voxel_size the returned buffer is
+        read-only, it is kept for reuse by the next overlapping window
+        """
+        if self.voxel_size is not None:
+            self._previous = None
+            return np.concatenate(list(self.iter_sweeps(frame_id)))
+
+        frame_ids = self._window_frames(frame_id)
+        try:
+            rotations, translations = self._window_poses(frame_ids)
+        except (ValueError, TypeError):
+            print('warning: part of the frames have no available pose information, return first frame point instead')
+            self._previous = None
+            return np.array(self.dataset.load_point_cloud(self.seq_id, frame_id))
+
+        counts = [self.dataset.frame_point_count(self.seq_id, f) for f in frame_ids]
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        accumulated = np.empty((offsets[-1], 4), dtype=np.float32)
+        reused = self._reuse_previous_window(frame_ids, offsets, rotations, translations, accumulated)
+
+        def load_into(i):
+            self._transform_sweep(frame_ids[i], rotations[i], translations[i], accumulated[offsets[i]:offsets[i + 1]])
+
+        to_load = [i for i in range(len(frame_ids)) if i not in reused]
+        if len(to_load) > 1 and self.num_workers > 1:
+            with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+                list(executor.map(load_into, to_load))
+        else:
+            for i in to_load:
+                load_into(i)
+
+        # Callers must not edit the buffer the next window is rebuilt from
+        accumulated.setflags(write=False)
+        self._previous = (frame_ids, offsets, rotations, translations, accumulated)
+        return accumulated
+
+    def _reuse_previous_window(self, frame_ids, offsets, rotations, translations, accumulated):
+        """Copy sweeps shared with the previous window, moving them from its reference to the new one"""
+        reused = set()
+        if self._previous is None:
+            return reused
+        prev_frame_ids, prev_offsets, prev_rotations, prev_translations, prev_accumulated = self._previous
+        prev_positions = {f: i for i, f in enumerate(prev_frame_ids)}
+        for i, current_frame_id in enumerate(frame_ids):
+            j = prev_positions.get(current_frame_id)
+            if j is None:
+                continue
+            # new = R_new R_prev^T (old - t_prev) + t_new
+            delta_rotation = np.dot(rotations[i], prev_rotations[j].T)
+            src = prev_accumulated[prev_offsets[j]:prev_offsets[j + 1]]
+            out = accumulated[offsets[i]:offsets[i + 1]]
+            np.matmul(src[:, :3] - prev_translations[j], delta_rotation.T, out=out[:, :3])
+            out[:, :3] += translations[i]
+            out[:, 3] = src[:, 3]
+            reused.add(i)
+        return reused
+
+
+def accumulate_frames(dataset, seq_id, frame_id, concat_cnt=0, voxel_size=None, num_workers=4, in_sensor_frame=False):
+    """Single dense cloud of frame_id and the following concat_cnt sweeps, loaded in parallel into one buffer"""
+    accumulator = PointCloudAccumulator(dataset, seq_id, concat_cnt + 1, voxel_size, num_workers, in_sensor_frame)
+    return accumulator.accumulate(frame_id)
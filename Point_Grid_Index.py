@@ -0,0 +1,66 @@
+import numpy as np
+
+
+class PointGridIndex(object):
+    """
+    Uniform XY grid over one point cloud. Points are bucketed by cell (counting sort), so the
+    candidates inside a slab around a line are gathered by walking only the cells the slab crosses.
+    """
+
+    def __init__(self, points, cell_size=1.0):
+        points_xy = np.asarray(points)[:, :2].astype(np.float64)
+        self.cell_size = float(cell_size)
+        self.num_points = len(points_xy)
+        if self.num_points:
+            self.origin = points_xy.min(axis=0)
+            self.shape = (np.floor((points_xy.max(axis=0) - self.origin) / self.cell_size).astype(np.int64) + 1)
+        else:
+            self.origin = np.zeros(2)
+            self.shape = np.ones(2, dtype=np.int64)
+        cell_ids = self._cell_coords(points_xy) @ np.array([self.shape[1], 1])
+        self.order = np.argsort(cell_ids, kind='stable')
+        self.cell_starts = np.concatenate([[0], np.cumsum(np.bincount(cell_ids, minlength=int(np.prod(self.shape))))])
+
+    def _cell_coords(self, points_xy):
+        cell_coords = np.floor((points_xy - self.origin) / self.cell_size).astype(np.int64)
+        return np.clip(cell_coords, 0, self.shape - 1)
+
+    def cells_near_line(self, p1, p2, half_width):
+        """Flat ids of every cell intersecting the slab |distance to the infinite XY line through p1, p2| < half_width"""
+        p1 = np.asarray(p1, dtype=np.float64)[:2] - self.origin
+        direction = np.asarray(p2, dtype=np.float64)[:2] - self.origin - p1
+        # Walk along the dominant axis so every step touches a bounded run of cells on the other one
+        major = 0 if abs(direction[0]) >= abs(direction[1]) else 1
+        minor = 1 - major
+        slope = direction[minor] / direction[major]
+        # Small margin keeps points sitting exactly on the slab border despite rounding
+        half_thickness = half_width * np.hypot(1.0, slope) + 1e-9
+
+        columns = np.arange(self.shape[major])
+        edges = np.stack([columns, columns + 1]) * self.cell_size
+        minor_at_edges = p1[minor] + (edges - p1[major]) * slope
+        lower = np.floor((minor_at_edges.min(axis=0) - half_thickness) / self.cell_size).astype(np.int64)
+        upper = np.floor((minor_at_edges.max(axis=0) + half_thickness) / self.cell_size).astype(np.int64)
+        lower = np.maximum(lower, 0)
+        upper = np.minimum(upper, self.shape[minor] - 1)
+        valid = upper >= lower
+        columns, lower, upper = columns[valid], lower[valid], upper[valid]
+
+        run_lengths = upper - lower + 1
+        column_of_cell = np.repeat(columns, run_lengths)
+        offsets = np.arange(run_lengths.sum()) - np.repeat(np.cumsum(run_lengths) - run_lengths, run_lengths)
+        minor_of_cell = np.repeat(lower, run_lengths) + offsets
+        cell_coords = np.empty((len(column_of_cell), 2), dtype=np.int64)
+        cell_coords[:, major] = column_of_cell
+        cell_coords[:, minor] = minor_of_cell
+        return cell_coords @ np.array([self.shape[1], 1])
+
+    def query_slab(self, p1, p2, half_width):
+        """Sorted indices of the points in every cell the slab crosses, a superset of the points inside it"""
+        if self.num_points == 0:
+            return np.zeros(0, dtype=np.int64)
+        cells = self.cells_near_line(p1, p2, half_width)
+        starts, ends = self.cell_starts[cells], self.cell_starts[cells + 1]
+        counts = ends - starts
+        positions = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(starts, counts)
+        return np.sort(self.order[positions])
@@ -0,0 +1,102 @@
+import numpy as np
+from Calculate_Boundary import indexed_candidate_pairs, group_strip_pairs
+from Point_Grid_Index import PointGridIndex
+from Utility_For_Calculating_Boundary import EdgeGeometry
+
+
+class ThresholdSweep(object):
+    """
+    Evaluates many (base_threshold, max_threshold) pairs on one frame. Point to edge distances, along-edge ratios and
+    the within-edge test are computed once for the largest max_threshold, every pair is then a few array comparisons.
+    Strip members of all pairs are projected into the cameras in a single batched call.
+    Each pair gives the same strips as extract_boundary_strips(points, edges, max, base, max) and the same
+    2D strip coordinates as project_own_lidar_to_image_remove_noise(..., render=False) on them.
+    """
+
+    def __init__(self, dataset, seq_id, frame_id, points, frustum_edges, image_size=None):
+        self.dataset = dataset
+        self.seq_id = seq_id
+        self.frame_id = frame_id
+        self.points_xyz = np.asarray(points, dtype=np.float64)[:, :3]
+        self.image_size = image_size if image_size is not None else dataset.image_size
+        self.geometry = frustum_edges if isinstance(frustum_edges, EdgeGeometry) else \
+            EdgeGeometry.from_frustum_edges(frustum_edges)
+        self.strip_names = self.geometry.strip_names
+        self.grid_index = PointGridIndex(self.points_xyz)
+        self._radius = None
+
+    def _candidate_geometry(self, radius):
+        """Candidate pairs within radius plus their distance, along-edge ratio and within-edge flag, cached"""
+        if self._radius is not None and radius <= self._radius:
+            return self._geometry
+        point_idx, edge_idx, distances, projection_lengths = indexed_candidate_pairs(self.points_xyz, self.geometry,
+                                                                                     radius, self.grid_index)
+        angle_ratio = self.geometry.angle_ratios(self.points_xyz[point_idx], edge_idx)
+        within_edge = self.geometry.within_edge(None, edge_idx, projection_lengths=projection_lengths)
+        candidate_points, point_slot = np.unique(point_idx, return_inverse=True)
+        self._radius = radius
+        self._geometry = (point_idx, edge_idx, distances, angle_ratio, within_edge, candidate_points, point_slot)
+        return self._geometry
+
+    def evaluate(self, threshold_pairs):
+        """
+        Strip sets of every (base_threshold, max_threshold) pair, max_threshold is also the candidate distance
+        :return: list of {strip_name: index array into points}, in the order of threshold_pairs
+        """
+        thresholds = np.asarray(threshold_pairs, dtype=np.float64).reshape(-1, 2)
+        if len(thresholds) == 0 or len(self.points_xyz) == 0 or len(self.geometry) == 0:
+            return [{} for _ in range(len(thresholds))]
+        point_idx, edge_idx, distances, angle_ratio, within_edge, candidate_points, point_slot = \
+            self._candidate_geometry(thresholds[:, 1].max())
+
+        base_thresholds, max_thresholds = thresholds[:, :1], thresholds[:, 1:]
+        dynamic_thresholds = self.geometry.angular_thresholds(None, base_thresholds, max_thresholds,
+                                                              angle_ratios=angle_ratio)
+        candidates = np.abs(distances) < max_thresholds
+        qualifying = candidates & (distances < dynamic_thresholds) & within_edge
+        qualified = np.zeros((len(thresholds), len(candidate_points)), dtype=bool)
+        pair_ids, candidate_ids = np.nonzero(qualifying)
+        qualified[pair_ids, point_slot[candidate_ids]] = True
+        members = candidates & qualified[:, point_slot] & (np.abs(distances) < dynamic_thresholds)
+
+        return [group_strip_pairs(point_idx[member_mask], edge_idx[member_mask], self.strip_names)
+                for member_mask in members]
+
+    def project(self, strip_sets):
+        """
+        Per camera 2D strip coordinates of every strip set, in the format of project_own_lidar_to_image_remove_noise
+        Points used by any strip set are projected once, the sets only select from that table
+        """
+        camera_names = self.dataset.__class__.camera_names
+        used_points = np.unique(np.concatenate([np.zeros(0, dtype=np.int64)] +
+                                               [indices for strips in strip_sets for indices in strips.values()]))
+        projection = self.dataset.project_points_to_cameras(self.seq_id, self.frame_id, self.points_xyz[used_points],
+                                                            image_size=self.image_size)
+        visible = np.zeros((len(camera_names), len(used_points)), dtype=bool)
+        visible[projection.cam_id, projection.point_idx] = True
+        u = np.zeros(visible.shape)
+        v = np.zeros(visible.shape)
+        u[projection.cam_id, projection.point_idx] = projection.u
+        v[projection.cam_id, projection.point_idx] = projection.v
+
+        projected_sets = []
+        for strips in strip_sets:
+            return_dictionary = {cam_name: [] for cam_name in camera_names}
+            for cam_no, cam_name in enumerate(camera_names):
+                for strip_name, indices in strips.items():
+                    # strips of the camera itself are not projected back into it
+                    if cam_name in strip_name:
+                        continue
+                    slots = np.searchsorted(used_points, indices)
+                    slots = slots[visible[cam_no, slots]]
+                    for point_u, point_v in zip(u[cam_no, slots], v[cam_no, slots]):
+                        return_dictionary[cam_name].append((strip_name, [point_u, self.image_size[1] - point_v, 1.0]))
+            projected_sets.append(return_dictionary)
+        return projected_sets
+
+    def run(self, threshold_pairs):
+        """{(base_threshold, max_threshold): (strip indices, projected 2D strip points)} for every pair"""
+        strip_sets = self.evaluate(threshold_pairs)
+        projected_sets = self.project(strip_sets)
+        return {(float(base), float(maximum)): (strips, projected)
+                for (base, maximum), strips, projected in zip(threshold_pairs, strip_sets, projected_sets)}
@@ -1,53 +1,140 @@
 import numpy as np
 
+
+class EdgeGeometry(object):
+    """
+    Array-backed geometry of a fixed set of edges (e.g. the frustum top edges of one calibration).
+    Origins, unit local Y-axes, unit directions and lengths are computed once; every query is batched
+    over points, either densely against all edges (N, E) or for explicit (point, edge_idx) pairs.
+    """
+
+    def __init__(self, edges, edge_cams=None, edge_ids=None):
+        edges = np.asarray(edges, dtype=np.float64).reshape(-1, 2, 3)
+        self.origins = edges[:, 0]
+        self.ends = edges[:, 1]
+        self.vectors = self.ends - self.origins
+        self.lengths = np.linalg.norm(self.vectors, axis=1)
+        self.directions = self.vectors / self.lengths[:, None]
+        self.local_y = define_local_y_axis(self.origins, self.ends)
+        self.local_y_offsets = self.origins[:, 0] * self.local_y[:, 0] + self.origins[:, 1] * self.local_y[:, 1]
+        self.vector_offsets = self.origins[:, 0] * self.vectors[:, 0] + self.origins[:, 1] * self.vectors[:, 1] + \
+            self.origins[:, 2] * self.vectors[:, 2]
+        self.edge_cams = list(edge_cams) if edge_cams is not None else [None] * len(edges)
+        self.edge_ids = np.asarray(edge_ids if edge_ids is not None else np.arange(len(edges)), dtype=np.int64)
+
+    @classmethod
+    def from_frustum_edges(cls, frustum_edges):
+        """Flatten {cam: [(p1, p2), ...]} from extract_top_edges, rows keep camera order then edge order"""
+        edge_cams, edge_ids, edges = [], [], []
+        for cam, cam_edges in frustum_edges.items():
+            for edge_idx, (p1, p2) in enumerate(cam_edges):
+                edge_cams.append(cam)
+                edge_ids.append(edge_idx)
+                edges.append((p1, p2))
+        return cls(edges, edge_cams, edge_ids)
+
+    def __len__(self):
+        return len(self.origins)
+
+    @property
+    def edges(self):
+        """(E, 2, 3) edge tensor"""
+        return np.stack([self.origins, self.ends], axis=1)
+
+    @property
+    def strip_names(self):
+        return [f"{cam}_strip{edge_id}" for cam, edge_id in zip(self.edge_cams, self.edge_ids.tolist())]
+
+    @staticmethod
+    def _batch(points, edge_idx):
+        """Point columns and edge selector, dense (N, E) broadcasting when edge_idx is None, else pairwise"""
+        points = np.asarray(points, dtype=np.float64)
+        if edge_idx is None:
+            return points[:, :3, None], slice(None)
+        return points[:, :3], edge_idx
+
+    def signed_distances(self, points, edge_idx=None):
+        """Signed XY distance of points along each edge's local Y-axis"""
+        p, e = self._batch(points, edge_idx)
+        return p[:, 0] * self.local_y[e, 0] + p[:, 1] * self.local_y[e, 1] - self.local_y_offsets[e]
+
+    def projection_lengths(self, points, edge_idx=None):
+        """Length of the projection of point - origin onto the edge direction"""
+        p, e = self._batch(points, edge_idx)
+        return (p[:, 0] * self.vectors[e, 0] + p[:, 1] * self.vectors[e, 1] + p[:, 2] * self.vectors[e, 2] -
+                self.vector_offsets[e]) / self.lengths[e]
+
+    def within_edge(self, points, edge_idx=None, projection_lengths=None):
+        if projection_lengths is None:
+            projection_lengths = self.projection_lengths(points, edge_idx)
+        lengths = self.lengths if edge_idx is None else self.lengths[edge_idx]
+        return (projection_lengths >= 0) & (projection_lengths <= lengths)
+
+    def angle_ratios(self, points, edge_idx=None):
+        """Distance of points from the edge origin relative to the edge length"""
+        points = np.asarray(points, dtype=np.float64)[:, :3]
+        if edge_idx is None:
+            return np.linalg.norm(points[:, None, :] - self.origins[None], axis=2) / self.lengths
+        return np.linalg.norm(points - self.origins[edge_idx], axis=1) / self.lengths[edge_idx]
+
+    def angular_thresholds(self, points, base_threshold, max_threshold, edge_idx=None, angle_ratios=None):
+        if angle_ratios is None:
+            angle_ratios = self.angle_ratios(points, edge_idx)
+        return base_threshold + (max_threshold - base_threshold) * angle_ratios
+
+
 def distance_to_line_along_local_y(point, p1, p2):
-    """Calculate the perpendicular distance from a point to a line along the local Y-axis."""
+    """Calculate the perpendicular distance from a point (or (N, 3) points) to a line along the local Y-axis."""
+    distance, _ = _signed_distance_along_local_y(point, p1, p2)
+    return np.abs(distance)
+
+def _signed_distance_along_local_y(point, p1, p2):
     local_y_axis = define_local_y_axis(p1, p2)
-    point_vector = np.array(point) - np.array(p1)
-    point_vector[2] = 0  # Ignore the Z component
-    projection_length = np.dot(point_vector, local_y_axis)
-    return abs(projection_length)
+    point_vector = np.array(point, dtype=np.float64) - np.asarray(p1, dtype=np.float64)
+    point_vector[..., 2] = 0  # Ignore the Z component
+    return np.sum(point_vector * local_y_axis, axis=-1), local_y_axis
 
 def define_local_y_axis(p1, p2):
-    """Define a local Y-axis orthogonal to the line segment in the XY plane."""
+    """Define a local Y-axis orthogonal to the line segment in the XY plane, (E, 3) axes for (E, 3) endpoints."""
     global_z = np.array([0, 0, 1])  # Global Z-axis
-    edge_vector = np.array(p2) - np.array(p1)
-    edge_vector[2] = 0  # Ignore the Z component
+    edge_vector = np.array(p2, dtype=np.float64) - np.asarray(p1, dtype=np.float64)
+    edge_vector[..., 2] = 0  # Ignore the Z component
     local_y = np.cross(global_z, edge_vector)  # Cross product to find a vector orthogonal in the XY plane
-    local_y_normalized = local_y / np.linalg.norm(local_y)  # Normalize the vector
+    local_y_normalized = local_y / np.linalg.norm(local_y, axis=-1, keepdims=True)  # Normalize the vector
     return local_y_normalized
 
 def is_near_boundary_and_within_edge(point_distances, base_threshold, max_threshold):
     """Determine if a point is near a boundary and within an edge using a dynamic angular threshold."""
-    for entry in point_distances:
-        distance, dynamic_threshold, _ = distance_to_line_along_local_y_FOR_LATER(entry['lidar_point'], entry['edge_coordinates'][0], entry['edge_coordinates'][1], base_threshold, max_threshold)
-        if distance < dynamic_threshold and is_point_within_edge(entry['lidar_point'], entry['edge_coordinates']):
-            return True
-    return False
+    if not point_distances:
+        return False
+    points = np.array([entry['lidar_point'] for entry in point_distances], dtype=np.float64)[:, :3]
+    geometry = EdgeGeometry([entry['edge_coordinates'] for entry in point_distances])
+    edge_idx = np.arange(len(geometry))
+    distance = geometry.signed_distances(points, edge_idx)
+    dynamic_threshold = geometry.angular_thresholds(points, base_threshold, max_threshold, edge_idx)
+    return bool(np.any((distance < dynamic_threshold) & geometry.within_edge(points, edge_idx)))
 
 def distance_to_line_along_local_y_FOR_LATER(point, p1, p2, base_threshold, max_threshold):
     """Calculate the perpendicular distance from a point to a line along the local Y-axis and apply angular threshold."""
-    local_y_axis = define_local_y_axis(p1, p2)
-    point_vector = np.array(point) - np.array(p1)
-    point_vector[2] = 0  # Ignore the Z component
-    projection_length = np.dot(point_vector, local_y_axis)
-    distance = projection_length
+    distance, local_y_axis = _signed_distance_along_local_y(point, p1, p2)
     dynamic_threshold = calculate_angular_threshold(p1, p2, base_threshold, max_threshold, point)
     return distance, dynamic_threshold, local_y_axis
 
 def is_point_within_edge(point, edge_coordinates):
-    """Check if the LiDAR point is within the segment defined by the edge coordinates."""
-    p1, p2 = np.array(edge_coordinates[0]), np.array(edge_coordinates[1])
+    """Check if the LiDAR point (or (N, 3) points) is within the segment defined by the edge coordinates."""
+    edge_coordinates = np.asarray(edge_coordinates, dtype=np.float64)
+    p1, p2 = edge_coordinates[..., 0, :], edge_coordinates[..., 1, :]
     edge_vector = p2 - p1
-    point_vector = np.array(point) - p1
+    point_vector = np.asarray(point, dtype=np.float64) - p1
+    edge_length = np.linalg.norm(edge_vector, axis=-1)
     # Project point_vector onto edge_vector
-    proj_length = np.dot(point_vector, edge_vector) / np.linalg.norm(edge_vector)
+    proj_length = np.sum(point_vector * edge_vector, axis=-1) / edge_length
     # Check if the projection length is between 0 and the length of the edge_vector
-    return 0 <= proj_length <= np.linalg.norm(edge_vector)
+    return (0 <= proj_length) & (proj_length <= edge_length)
 
 def calculate_angular_threshold(p1, p2, base_threshold, max_threshold, point):
     """Calculate dynamic threshold based on the position along the line."""
-    line_length = np.linalg.norm(np.array(p2) - np.array(p1))
-    point_position = np.linalg.norm(np.array(point) - np.array(p1))
+    line_length = np.linalg.norm(np.asarray(p2, dtype=np.float64) - np.asarray(p1, dtype=np.float64), axis=-1)
+    point_position = np.linalg.norm(np.asarray(point, dtype=np.float64) - np.asarray(p1, dtype=np.float64), axis=-1)
     angle_ratio = point_position / line_length  # Ratio of position along the line
-    return base_threshold + (max_threshold - base_threshold) * angle_ratio  # Linear interpolation
\ No newline at end of file
+    return base_threshold + (max_threshold - base_threshold) * angle_ratio  # Linear interpolation
@@ -7,22 +7,30 @@ from General_Utility import check_folder
 
 # Load the trained model
 
-def predict_on_images(model_path, image_folder_path, cams):
+def predict_on_images(model_path, image_folder_path, cams, render=True):
     model = YOLO(model_path)
     save_folder = os.path.join(image_folder_path, "Images_With_Predictions")
     save_folder_boundaries = os.path.join(image_folder_path, "Overlap_Boundaries_With_Predictions")
     images_folder = os.path.join(image_folder_path, "Undistorted_Images")
     boundary_images_folder = os.path.join(image_folder_path, "Overlap_Boundaries")
-    check_folder(save_folder)
-    check_folder(save_folder_boundaries)
+    if render:
+        check_folder(save_folder)
+        check_folder(save_folder_boundaries)
 
     detections = []  # List to store detection info for all images
     for i,image_name in enumerate(os.listdir(images_folder)):
         img_path = os.path.join(images_folder, image_name)
+        img = cv2.imread(img_path)
+
+        if not render:
+            # Headless: keep the detections, skip plotting and writing the annotated images
+            results = model(img, verbose=False)
+            if results:
+                detections.append(DetectionInfo(image_name, results[0], img.shape))
+            continue
 
         boundary_image_name = image_name.split(".")[0] + "_Boundaries.jpg"
         boundary_img_path = os.path.join(boundary_images_folder, boundary_image_name)
-        img = cv2.imread(img_path)
         boundary_img = cv2.imread(boundary_img_path)
 
 
@@ -1,14 +1,17 @@
 from once import ONCE
-from Frustum import return_frustums, project_frustum_to_image
-from Calculate_Boundary import distances_from_points_to_frustums, create_boundary_dict
+from Frustum import return_frustums, precompute_sequence_overlap
+from Calculate_Boundary import extract_boundary_strips, stream_boundary_strips, analytic_boundary_strips
+from Threshold_Sweep import ThresholdSweep
 from General_Utility import image_creation, visualize_coloured_frustums_with_point_cloud, visualise_frustums_with_point_cloud, visualise_top_edges_with_point_cloud
 from Logging import logger
 from YoloV8_On_Dataset import predict_on_images
 from Load_And_Save import load_and_save_images
 from Determine_Object_Overlap import bounding_boxes_in_overlap
+from Point_Boundary_Seperator import OverlapLabelMap
+from Boundary_Smoothing import build_boundary_models
 from Lidar_points_to_image_tracking import extract_points
 from Calculate_Objects_Across_Image import object_across_image
-import time
+from Point_Cloud_Accumulation import PointCloudAccumulator
 import datetime
 
 
@@ -23,7 +26,7 @@ MAIN FUNCTION FOR CALCULATING THE BOUNDARY
 INFORMATION FOR ALL RELEVANT FUNCTIONS
 """
 
-dataset = ONCE(r'C:\Users\evans\OneDrive - University of Southampton\Desktop\Year 3\Year 3 Project\Full_DataSet')
+dataset = ONCE(r'C:\Users\evans\OneDrive - University of Southampton\Desktop\Year 3\Year 3 Project\Full_DataSet', lazy=True)
 seq_id = "000076"
 frame_id = "1616343528200"
 #seq_id = "000028"
@@ -39,6 +42,29 @@ base_threshold = 0.3
 
 query_points_single = [[100,800]]
 
+# "lidar" refines the boundaries from LiDAR points near the frustum top edges, "analytic" samples the edges directly
+boundary_mode = "lidar"
+analytic_boundary_spacing = 0.5
+# Project the analytic boundary samples vertically onto the plane z = height (LiDAR frame), None keeps the top edges
+analytic_boundary_height = None
+
+# Extra sweeps aggregated into the boundary cloud for denser strips (0 uses the current sweep only)
+accumulated_sweeps = 0
+accumulation_voxel_size = 0.05
+# Points per chunk when extracting strips from accumulated clouds, bounds peak memory
+boundary_chunk_size = 1 << 20
+
+# Extra (base_threshold, max_threshold) pairs evaluated in one sweep on the same frame, e.g. [(0.2, 0.5), (0.3, 0.6)]
+threshold_sweep_pairs = []
+
+# Cell size in pixels of the rasterized overlap label maps used for detection lookups (None classifies exactly)
+overlap_label_downsample = None
+# Fit the projected strips into continuous x(y) boundaries with this Gaussian sigma (None matches nearest strip points)
+boundary_smoothing_sigma = None
+
+# False runs every stage headless: no overlays are drawn and only the undistorted inputs for YOLO are written
+render = True
+
 image_height = 1020
 image_width = 1920
 
@@ -53,20 +79,12 @@ save_location = rf"C:\Users\evans\OneDrive - University of Southampton\Desktop\Y
 
 
 """
-Load_And_Save_Images
-"""
-logger.info("Loading and undistorting dataset images")
-load_and_save_images(dataset, seq_id, frame_id, image_save, cam_names)
-
-
-"""
-Extract lidar points and camera parameters
+Extract camera parameters (calibration only, no image I/O)
 """
 
 logger.info("Extracting camera parameters")
 new_cam_intrinsics_dict, old_intrinsic_dict, extrinsic_dict = dataset.get_vital_info(seq_id, frame_id)
-logger.info("Extracting Pointcloud")
-img_buf_dict, unique_points, colours = dataset.project_lidar_to_image_with_colour(seq_id, frame_id)
+camera_models = dataset.get_camera_models(seq_id)
 
 """
 Calculate Frustum Corners
@@ -77,49 +95,82 @@ package_info = [new_cam_intrinsics_dict, old_intrinsic_dict, extrinsic_dict, cam
 frustums, top_edges = return_frustums(package_info)
 
 #print(frustums)
-#print(unique_points)
 print(top_edges)
 
 """
 Generate general overlapping regions
 """
 
-time.sleep(0.1)
-overlap = project_frustum_to_image(new_cam_intrinsics_dict, extrinsic_dict, frustums, image_width, image_height)
+# Calibration-only, computed once per sequence and cached in <dataset_root>/overlap_cache
+overlap, _, _ = precompute_sequence_overlap(dataset, seq_id, cam_names, near_plane, far_plane,
+                                            image_width, image_height)
 #print(overlap)
 
-#ok = visualise_frustums_with_point_cloud(unique_points, top_edges, True, True)
-#nok = visualise_top_edges_with_point_cloud(unique_points, top_edges, True, False)
 
+"""
+Load_And_Save_Images
+"""
+logger.info("Loading and undistorting dataset images")
+load_and_save_images(dataset, seq_id, frame_id, image_save, cam_names)
 
 
 """
-Calculate Boundary
+Extract lidar points
 """
 
-logger.info("Calculating lidar distances from frustum edges")
-distances = distances_from_points_to_frustums(unique_points, top_edges, max_threshold)
+logger.info("Extracting Pointcloud")
+img_buf_dict, unique_points, colours = dataset.project_lidar_to_image_with_colour(seq_id, frame_id, render=render)
+if accumulated_sweeps > 0:
+    # the accumulated boundary cloud is streamed sweep by sweep, never built in full for the strips
+    accumulator = PointCloudAccumulator(dataset, seq_id, accumulated_sweeps + 1, accumulation_voxel_size,
+                                        in_sensor_frame=True)
+#print(unique_points)
+
+#ok = visualise_frustums_with_point_cloud(unique_points, top_edges, True, True)
+#nok = visualise_top_edges_with_point_cloud(unique_points, top_edges, True, False)
+
 
 
 """
-Refine Boundary
+Calculate and Refine Boundary
 """
-logger.info("Refining Boundary")
-lidar_boundary_strips = create_boundary_dict(distances, base_threshold, max_threshold)
+
+if boundary_mode == "analytic":
+    logger.info("Sampling boundary strips from the frustum top edges")
+    strip_indices = None
+    lidar_boundary_strips = analytic_boundary_strips(top_edges, analytic_boundary_spacing, analytic_boundary_height)
+elif accumulated_sweeps > 0:
+    logger.info(f"Extracting boundary strips from {accumulated_sweeps + 1} accumulated sweeps")
+    strip_indices, lidar_boundary_strips = stream_boundary_strips(accumulator.iter_sweeps(frame_id), top_edges,
+                                                                  max_threshold, base_threshold, max_threshold,
+                                                                  chunk_size=boundary_chunk_size)
+else:
+    logger.info("Extracting boundary strips from frustum edge distances")
+    strip_indices = extract_boundary_strips(unique_points, top_edges, max_threshold, base_threshold, max_threshold)
+    lidar_boundary_strips = {strip_name: unique_points[indices] for strip_name, indices in strip_indices.items()}
+
+if threshold_sweep_pairs and boundary_mode == "lidar":
+    logger.info(f"Sweeping {len(threshold_sweep_pairs)} threshold pairs")
+    # the sweep needs random access to the whole cloud, so an accumulated one is only built here
+    sweep_points = accumulator.accumulate(frame_id)[:, :3] if accumulated_sweeps > 0 else unique_points
+    threshold_sweep = ThresholdSweep(dataset, seq_id, frame_id, sweep_points, top_edges).run(threshold_sweep_pairs)
+    for (sweep_base, sweep_max), (sweep_strips, _) in threshold_sweep.items():
+        logger.info(f"Base_{sweep_base}_Max_{sweep_max}: "
+                    f"{ {strip_name: len(indices) for strip_name, indices in sweep_strips.items()} }")
 
 
 """
 Display and retrieve 2D strip coordinates
 """
 logger.info("Retrieving 2D coordinates")
-projected_points_to_images = image_creation(seq_id, frame_id, lidar_boundary_strips, image_save, dataset)
+projected_points_to_images = image_creation(seq_id, frame_id, lidar_boundary_strips, image_save, dataset, render=render)
 
 
 """
 Extract Yolo_Data
 """
 logger.info("Predicting_Images_Using_Yolo_Model")
-yolo_data = predict_on_images(yolo_model_path, image_save, cam_names)
+yolo_data = predict_on_images(yolo_model_path, image_save, cam_names, render=render)
 
 
 """
@@ -127,14 +178,22 @@ Determine whether an YOLO bounding box is in the overlap
 """
 
 logger.info("Determining whether an objecting is in the YOLO bounding box overlap")
-coordinate_info = bounding_boxes_in_overlap(projected_points_to_images, overlap, yolo_data, image_save)
+boundary_models = None
+if boundary_smoothing_sigma is not None:
+    boundary_models = build_boundary_models(projected_points_to_images, boundary_smoothing_sigma)
+overlap_label_map = None
+if overlap_label_downsample:
+    overlap_label_map = OverlapLabelMap(projected_points_to_images, overlap, (image_width, image_height),
+                                        overlap_label_downsample, strip_indices=boundary_models)
+coordinate_info = bounding_boxes_in_overlap(projected_points_to_images, overlap, yolo_data, image_save, render=render,
+                                            label_map=overlap_label_map, strip_models=boundary_models)
 
 """
 Extract LIDAR and respective 2d image coordinates for each image
 """
 
 logger.info("Extracting lidar and 2d image coordinates for each image")
-point_trackers = extract_points(dataset, seq_id, frame_id, image_save)
+point_trackers = extract_points(dataset, seq_id, frame_id, image_save, render=render)
 
 """
 Object Tracking
@@ -146,6 +205,7 @@ logger.info("Calculating position of object over images in a single frame")
 #print(data)
 
 
+logger.info(f"Undistorted image cache: {dataset.image_cache_info()}")
 now = datetime.datetime.now()
 print(now.time())
 
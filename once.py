@@ -1,26 +1,82 @@
 import json
 import functools
+import hashlib
+import os
 import os.path as osp
-from collections import defaultdict
+import threading
+from collections import defaultdict, OrderedDict, namedtuple
 import cv2
 import numpy as np
 from scipy.spatial.transform import Rotation
-import copy
+from Camera_Model import CameraModel
 
 
 def split_info_loader_helper(func):
     @functools.wraps(func)
-    def wrapper(*args, **kwargs):
-        split_file_path = func(*args, **kwargs)
-        if not osp.isfile(split_file_path):
-            split_list = []
-        else:
-            split_list = set(map(lambda x: x.strip(), open(split_file_path).readlines()))
-        return split_list
+    def wrapper(self, *args, **kwargs):
+        split_file_path = func(self, *args, **kwargs)
+        # split files are read once per instance, later reads are served from memory
+        cache = self.__dict__.setdefault('_split_list_cache', dict())
+        if split_file_path not in cache:
+            if not osp.isfile(split_file_path):
+                cache[split_file_path] = []
+            else:
+                with open(split_file_path) as f:
+                    cache[split_file_path] = set(map(lambda x: x.strip(), f.readlines()))
+        return cache[split_file_path]
 
     return wrapper
 
 
+# packed result of ONCE.project_points_to_cameras, one entry per (point, camera) pair
+LidarProjection = namedtuple('LidarProjection', ['point_idx', 'cam_id', 'u', 'v', 'depth'])
+
+
+class UndistortedImageCache(object):
+    """
+    LRU cache of undistorted images keyed by (seq_id, frame_id, cam_name) and bounded by total bytes.
+    Cached buffers are read-only, callers that draw on them have to take a copy first.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key, img_buf, new_cam_intrinsic):
+        img_buf.setflags(write=False)
+        new_cam_intrinsic.setflags(write=False)
+        if img_buf.nbytes > self.max_bytes:
+            return img_buf, new_cam_intrinsic
+        if key in self._entries:
+            self.current_bytes -= self._entries.pop(key)[0].nbytes
+        self._entries[key] = (img_buf, new_cam_intrinsic)
+        self.current_bytes += img_buf.nbytes
+        while self.current_bytes > self.max_bytes:
+            _, (old_buf, _) = self._entries.popitem(last=False)
+            self.current_bytes -= old_buf.nbytes
+        return img_buf, new_cam_intrinsic
+
+    def clear(self):
+        self._entries.clear()
+        self.current_bytes = 0
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'entries': len(self._entries), 'bytes': self.current_bytes}
+
+
 class ONCE(object):
     """
     dataset structure:
@@ -39,11 +95,46 @@ class ONCE(object):
     """
     camera_names = ['cam01', 'cam03', 'cam05', 'cam06', 'cam07', 'cam08', 'cam09']
     camera_tags = ['top', 'top2', 'left_back', 'left_front', 'right_front', 'right_back', 'back']
-
-    def __init__(self, dataset_root):
+    # ordered by the precedence used when a sequence id appears in several splits
+    split_names = ['raw_small', 'raw_medium', 'raw_large', 'train', 'test', 'val']
+    # memory-mapped sweeps kept open across all sequences, each mapping holds a file descriptor
+    max_cached_point_clouds = 64
+    # (width, height) of every ONCE camera image
+    image_size = (1920, 1020)
+    # undistortion maps take ~12MB per camera, keep roughly two sequences worth in memory
+    max_cached_undistort_maps = 14
+
+    def __init__(self, dataset_root, lazy=False, max_cached_seqs=8, preload=None, image_cache_bytes=256 * 1024 ** 2,
+                 remap_cache_dir=None):
+        """
+        :param dataset_root: root folder of the ONCE dataset
+        :param lazy: only index the splits up front and parse a sequence's annotation file on first access
+        :param max_cached_seqs: number of lazily loaded sequences kept in memory (preloaded ones excluded), at least one
+        :param preload: sequence ids to load and pin in memory straight away (lazy mode)
+        :param image_cache_bytes: memory budget of the undistorted image cache, 0 disables caching
+        :param remap_cache_dir: optional folder where undistortion maps are saved and reused across runs
+        """
         self.dataset_root = dataset_root
         self.data_root = osp.join(self.dataset_root, 'data')
-        self._collect_basic_infos()
+        self.image_cache = UndistortedImageCache(image_cache_bytes)
+        self.remap_cache_dir = remap_cache_dir
+        self._undistort_maps = OrderedDict()
+        self._new_cam_intrinsics = dict()
+        self._camera_models = dict()
+        self._point_cloud_maps = OrderedDict()
+        # load_point_cloud is called from accumulation worker threads
+        self._point_cloud_lock = threading.Lock()
+        self.lazy = lazy
+        self.max_cached_seqs = max_cached_seqs
+        self._loaded_seqs = OrderedDict()
+        self._pinned_seqs = set()
+        self._init_info_dicts()
+        self._collect_split_index()
+        if self.lazy:
+            if preload is not None:
+                self.preload(preload)
+        else:
+            self._collect_basic_infos()
 
     @property
     @split_info_loader_helper
@@ -76,22 +167,12 @@ class ONCE(object):
         return osp.join(self.dataset_root, 'ImageSets', 'raw_large.txt')
 
     def _find_split_name(self, seq_id):
-        if seq_id in self.raw_small_split_list:
-            return 'raw_small'
-        elif seq_id in self.raw_medium_split_list:
-            return 'raw_medium'
-        elif seq_id in self.raw_large_split_list:
-            return 'raw_large'
-        if seq_id in self.train_split_list:
-            return 'train'
-        if seq_id in self.test_split_list:
-            return 'test'
-        if seq_id in self.val_split_list:
-            return 'val'
+        if seq_id in self._seq_split_index:
+            return self._seq_split_index[seq_id]
         print("sequence id {} corresponding to no split".format(seq_id))
         raise NotImplementedError
 
-    def _collect_basic_infos(self):
+    def _init_info_dicts(self):
         self.train_info = defaultdict(dict)
         self.val_info = defaultdict(dict)
         self.test_info = defaultdict(dict)
@@ -99,45 +180,125 @@ class ONCE(object):
         self.raw_medium_info = defaultdict(dict)
         self.raw_large_info = defaultdict(dict)
 
-        for attr in ['train', 'val', 'test', 'raw_small', 'raw_medium', 'raw_large']:
-            if getattr(self, '{}_split_list'.format(attr)) is not None:
-                split_list = getattr(self, '{}_split_list'.format(attr))
-                info_dict = getattr(self, '{}_info'.format(attr))
-                for seq in split_list:
-                    anno_file_path = osp.join(self.data_root, seq, '{}.json'.format(seq))
-                    if not osp.isfile(anno_file_path):
-                        print("no annotation file for sequence {}".format(seq))
-                        raise FileNotFoundError
-                    anno_file = json.load(open(anno_file_path, 'r'))
-                    frame_list = list()
-                    for frame_anno in anno_file['frames']:
-                        frame_list.append(str(frame_anno['frame_id']))
-                        info_dict[seq][frame_anno['frame_id']] = {
-                            'pose': frame_anno['pose'],
-                        }
-                        info_dict[seq][frame_anno['frame_id']]['calib'] = dict()
-                        for cam_name in self.__class__.camera_names:
-                            info_dict[seq][frame_anno['frame_id']]['calib'][cam_name] = {
-                                'cam_to_velo': np.array(anno_file['calib'][cam_name]['cam_to_velo']),
-                                'cam_intrinsic': np.array(anno_file['calib'][cam_name]['cam_intrinsic']),
-                                'distortion': np.array(anno_file['calib'][cam_name]['distortion'])
-                            }
-                        if 'annos' in frame_anno.keys():
-                            info_dict[seq][frame_anno['frame_id']]['annos'] = frame_anno['annos']
-                    info_dict[seq]['frame_list'] = sorted(frame_list)
+    def _collect_basic_infos(self):
+        for seq, split_name in self._seq_split_index.items():
+            getattr(self, '{}_info'.format(split_name))[seq] = self._load_seq_info(seq)
+
+    def _collect_split_index(self):
+        """Map every sequence id to its split once, so split lookups never touch the split files again"""
+        self._seq_split_index = dict()
+        for split_name in self.__class__.split_names:
+            for seq in getattr(self, '{}_split_list'.format(split_name)):
+                self._seq_split_index.setdefault(seq, split_name)
+
+    def _load_seq_info(self, seq):
+        anno_file_path = osp.join(self.data_root, seq, '{}.json'.format(seq))
+        if not osp.isfile(anno_file_path):
+            print("no annotation file for sequence {}".format(seq))
+            raise FileNotFoundError
+        with open(anno_file_path, 'r') as f:
+            anno_file = json.load(f)
+        seq_info = dict()
+        frame_list = list()
+        # calibration is per sequence, every frame refers to the same arrays
+        seq_calib = dict()
+        for cam_name in self.__class__.camera_names:
+            seq_calib[cam_name] = {
+                'cam_to_velo': np.array(anno_file['calib'][cam_name]['cam_to_velo']),
+                'cam_intrinsic': np.array(anno_file['calib'][cam_name]['cam_intrinsic']),
+                'distortion': np.array(anno_file['calib'][cam_name]['distortion'])
+            }
+        seq_info['calib'] = seq_calib
+        for frame_anno in anno_file['frames']:
+            frame_list.append(str(frame_anno['frame_id']))
+            seq_info[frame_anno['frame_id']] = {
+                'pose': frame_anno['pose'],
+                'calib': seq_calib,
+            }
+            if 'annos' in frame_anno.keys():
+                seq_info[frame_anno['frame_id']]['annos'] = frame_anno['annos']
+        seq_info['frame_list'] = sorted(frame_list)
+        return seq_info
+
+    def _get_seq_info(self, seq_id):
+        split_name = self._find_split_name(seq_id)
+        info_dict = getattr(self, '{}_info'.format(split_name))
+        if self.lazy and seq_id not in self._pinned_seqs:
+            if seq_id not in info_dict:
+                info_dict[seq_id] = self._load_seq_info(seq_id)
+            self._loaded_seqs[seq_id] = split_name
+            self._loaded_seqs.move_to_end(seq_id)
+            # evict the least recently used sequences so memory stays bounded, never the one just loaded
+            while len(self._loaded_seqs) > max(self.max_cached_seqs, 1):
+                old_seq, old_split = self._loaded_seqs.popitem(last=False)
+                del getattr(self, '{}_info'.format(old_split))[old_seq]
+                with self._point_cloud_lock:
+                    for key in [key for key in self._point_cloud_maps if key[0] == old_seq]:
+                        del self._point_cloud_maps[key]
+                self._drop_seq_calib_caches(old_seq)
+        return info_dict[seq_id]
+
+    def _get_frame_info(self, seq_id, frame_id):
+        return self._get_seq_info(seq_id)[frame_id]
+
+    def _drop_seq_calib_caches(self, seq_id):
+        for cache in (self._new_cam_intrinsics, self._camera_models):
+            for key in [key for key in cache if key[0] == seq_id]:
+                del cache[key]
+
+    def preload(self, seq_ids=None):
+        """Load and pin sequences in memory for batch jobs, all indexed sequences when seq_ids is None"""
+        if not self.lazy:
+            return
+        if seq_ids is None:
+            seq_ids = list(self._seq_split_index.keys())
+        for seq_id in seq_ids:
+            split_name = self._find_split_name(seq_id)
+            info_dict = getattr(self, '{}_info'.format(split_name))
+            if seq_id not in info_dict:
+                info_dict[seq_id] = self._load_seq_info(seq_id)
+            self._loaded_seqs.pop(seq_id, None)
+            self._pinned_seqs.add(seq_id)
 
     def get_frame_anno(self, seq_id, frame_id):
-        split_name = self._find_split_name(seq_id)
-        frame_info = getattr(self, '{}_info'.format(split_name))[seq_id][frame_id]
+        frame_info = self._get_frame_info(seq_id, frame_id)
         if 'annos' in frame_info:
             return frame_info['annos']
         return None
 
     def load_point_cloud(self, seq_id, frame_id):
+        """
+        Memory-mapped sweep as a read-only float32 (N, 4) view, repeated loads of a frame reuse the open mapping.
+        Mappings share one LRU over all sequences so the number of open file descriptors stays bounded
+        """
+        key = (seq_id, frame_id)
+        with self._point_cloud_lock:
+            points = self._point_cloud_maps.get(key)
+            if points is not None:
+                self._point_cloud_maps.move_to_end(key)
+                return points
         bin_path = osp.join(self.data_root, seq_id, 'lidar_roof', '{}.bin'.format(frame_id))
-        points = np.fromfile(bin_path, dtype=np.float32).reshape(-1, 4)
+        if osp.getsize(bin_path) == 0:
+            points = np.zeros((0, 4), dtype=np.float32)
+            points.setflags(write=False)
+        else:
+            points = np.asarray(np.memmap(bin_path, dtype=np.float32, mode='r')).reshape(-1, 4)
+        with self._point_cloud_lock:
+            # another thread may have mapped the same sweep meanwhile, keep a single mapping
+            points = self._point_cloud_maps.setdefault(key, points)
+            self._point_cloud_maps.move_to_end(key)
+            while len(self._point_cloud_maps) > self.__class__.max_cached_point_clouds:
+                self._point_cloud_maps.popitem(last=False)
         return points
 
+    def load_point_xyz(self, seq_id, frame_id):
+        """(N, 3) view of the sweep coordinates, no copy"""
+        return self.load_point_cloud(seq_id, frame_id)[:, :3]
+
+    def load_point_intensity(self, seq_id, frame_id):
+        """(N,) view of the sweep intensities, no copy"""
+        return self.load_point_cloud(seq_id, frame_id)[:, 3]
+
     def load_image(self, seq_id, frame_id, cam_name):
         cam_path = osp.join(self.data_root, seq_id, cam_name, '{}.jpg'.format(frame_id))
         img_buf = cv2.cvtColor(cv2.imread(cam_path), cv2.COLOR_BGR2RGB)
@@ -145,8 +306,7 @@ class ONCE(object):
 
     def undistort_image(self, seq_id, frame_id):
         img_list = []
-        split_name = self._find_split_name(seq_id)
-        frame_info = getattr(self, '{}_info'.format(split_name))[seq_id][frame_id]
+        frame_info = self._get_frame_info(seq_id, frame_id)
         for cam_name in self.__class__.camera_names:
             img_buf = self.load_image(seq_id, frame_id, cam_name)
             cam_calib = frame_info['calib'][cam_name]
@@ -159,49 +319,153 @@ class ONCE(object):
                                           newCameraMatrix=cam_calib['cam_intrinsic']))
         return img_list
 
-    def undistort_image_v2(self, seq_id, frame_id):
+    def _get_new_cam_intrinsic(self, seq_id, cam_name, cam_calib, image_size):
+        """Optimal new camera matrix from the stored calibration only, memoized per (sequence, camera, image size)"""
+        key = (seq_id, cam_name) + tuple(image_size)
+        if key not in self._new_cam_intrinsics:
+            new_cam_intrinsic, _ = cv2.getOptimalNewCameraMatrix(cam_calib['cam_intrinsic'],
+                                                                 cam_calib['distortion'],
+                                                                 image_size, alpha=0.0, newImgSize=image_size)
+            new_cam_intrinsic.setflags(write=False)
+            self._new_cam_intrinsics[key] = new_cam_intrinsic
+        return self._new_cam_intrinsics[key]
+
+    def get_new_cam_intrinsics(self, seq_id, frame_id=None, image_size=None):
+        """New intrinsics of every camera after undistortion, without reading any image"""
+        return {cam_name: camera_model.new_intrinsic
+                for cam_name, camera_model in self.get_camera_models(seq_id, image_size).items()}
+
+    def get_camera_models(self, seq_id, image_size=None):
+        """CameraModel of every camera, built once per (sequence, image size) and shared by all its frames"""
+        if image_size is None:
+            image_size = self.__class__.image_size
+        key = (seq_id,) + tuple(image_size)
+        if key not in self._camera_models:
+            seq_calib = self._get_seq_info(seq_id)['calib']
+            self._camera_models[key] = {
+                cam_name: CameraModel(cam_name, seq_calib[cam_name]['cam_to_velo'],
+                                      seq_calib[cam_name]['cam_intrinsic'], seq_calib[cam_name]['distortion'],
+                                      self._get_new_cam_intrinsic(seq_id, cam_name, seq_calib[cam_name], image_size),
+                                      image_size)
+                for cam_name in self.__class__.camera_names}
+        return self._camera_models[key]
+
+    def get_camera_model(self, seq_id, cam_name, image_size=None):
+        return self.get_camera_models(seq_id, image_size)[cam_name]
+
+    def _get_undistort_maps(self, seq_id, cam_name, cam_calib, image_size):
+        """
+        Calibration is fixed for a whole sequence, so the undistortion maps are built once per
+        (sequence, camera, image size) and every frame only pays for a cv2.remap
+        """
+        key = (seq_id, cam_name) + tuple(image_size)
+        if key in self._undistort_maps:
+            self._undistort_maps.move_to_end(key)
+            return self._undistort_maps[key]
+        cache_path = None
+        if self.remap_cache_dir is not None:
+            calib_hash = hashlib.md5(np.ascontiguousarray(cam_calib['cam_intrinsic'], dtype=np.float64).tobytes() +
+                                     np.ascontiguousarray(cam_calib['distortion'], dtype=np.float64).tobytes()).hexdigest()
+            cache_path = osp.join(self.remap_cache_dir, '{}_{}_{}x{}_{}.npz'.format(
+                seq_id, cam_name, image_size[0], image_size[1], calib_hash[:8]))
+        if cache_path is not None and osp.isfile(cache_path):
+            cached = np.load(cache_path)
+            maps = (cached['map1'], cached['map2'], cached['new_cam_intrinsic'])
+        else:
+            new_cam_intrinsic = self._get_new_cam_intrinsic(seq_id, cam_name, cam_calib, image_size)
+            map1, map2 = cv2.initUndistortRectifyMap(cam_calib['cam_intrinsic'], cam_calib['distortion'], None,
+                                                     new_cam_intrinsic, image_size, cv2.CV_16SC2)
+            maps = (map1, map2, new_cam_intrinsic)
+            if cache_path is not None:
+                os.makedirs(self.remap_cache_dir, exist_ok=True)
+                np.savez(cache_path, map1=map1, map2=map2, new_cam_intrinsic=new_cam_intrinsic)
+        self._undistort_maps[key] = maps
+        while len(self._undistort_maps) > self.__class__.max_cached_undistort_maps:
+            self._undistort_maps.popitem(last=False)
+        return maps
+
+    def _get_undistorted_image(self, seq_id, frame_id, cam_name):
+        key = (seq_id, frame_id, cam_name)
+        cached = self.image_cache.get(key)
+        if cached is not None:
+            return cached
+        img_buf = self.load_image(seq_id, frame_id, cam_name)
+        cam_calib = self._get_frame_info(seq_id, frame_id)['calib'][cam_name]
+        h, w = img_buf.shape[:2]
+        map1, map2, new_cam_intrinsic = self._get_undistort_maps(seq_id, cam_name, cam_calib, (w, h))
+        img_buf = cv2.remap(img_buf, map1, map2, cv2.INTER_LINEAR)
+        return self.image_cache.put(key, img_buf, new_cam_intrinsic)
+
+    def undistort_image_v2(self, seq_id, frame_id, writable=True):
+        """
+        :param writable: return private copies that can be drawn on, otherwise read-only views of the cached images
+        """
         img_list = []
         new_cam_intrinsic_dict = dict()
-        split_name = self._find_split_name(seq_id)
-        frame_info = getattr(self, '{}_info'.format(split_name))[seq_id][frame_id]
         for cam_name in self.__class__.camera_names:
-            img_buf = self.load_image(seq_id, frame_id, cam_name)
-            cam_calib = frame_info['calib'][cam_name]
-            h, w = img_buf.shape[:2]
-            new_cam_intrinsic, _ = cv2.getOptimalNewCameraMatrix(cam_calib['cam_intrinsic'],
-                                                                 cam_calib['distortion'],
-                                                                 (w, h), alpha=0.0, newImgSize=(w, h))
-            img_list.append(cv2.undistort(img_buf, cam_calib['cam_intrinsic'],
-                                          cam_calib['distortion'],
-                                          newCameraMatrix=new_cam_intrinsic))
+            img_buf, new_cam_intrinsic = self._get_undistorted_image(seq_id, frame_id, cam_name)
+            img_list.append(img_buf.copy() if writable else img_buf)
             new_cam_intrinsic_dict[cam_name] = new_cam_intrinsic
         return img_list, new_cam_intrinsic_dict
 
+    def image_cache_info(self):
+        return self.image_cache.info()
+
+    def _get_image_size(self, img_list):
+        """(width, height) used for bounds checks, the loaded images' own size when there are any"""
+        if img_list is None:
+            return self.__class__.image_size
+        return img_list[0].shape[1], img_list[0].shape[0]
+
+    def project_points_to_cameras(self, seq_id, frame_id, points_xyz, cam_names=None, image_size=None,
+                                  clip_to_image=True, strict_bounds=False):
+        """
+        Project LiDAR points into several cameras in one batch
+        :param frame_id: unused, calibration is per sequence; kept so the signature matches the per-frame callers
+        :param points_xyz: (N, 3+) array, only the first three columns are used
+        :param cam_names: cameras to project into, all cameras by default
+        :param image_size: (width, height) of the undistorted images, ONCE.image_size by default
+        :param clip_to_image: drop pairs that fall outside the image, otherwise only points behind the camera are dropped
+        :param strict_bounds: clip on the float coordinates (0 <= u < width) instead of on the truncated pixel
+        :return: LidarProjection with point_idx, cam_id (index into cam_names), u, v, depth,
+                 ordered by camera and then by point index
+        """
+        if cam_names is None:
+            cam_names = self.__class__.camera_names
+        if image_size is None:
+            image_size = self.__class__.image_size
+        camera_models = self.get_camera_models(seq_id, image_size)
+        projections = np.stack([camera_models[cam_name].projection for cam_name in cam_names])
+        points_xyz = np.asarray(points_xyz)[:, :3]
+        # (C, N, 3) homogeneous image coordinates for every camera at once
+        points_img = np.einsum('cij,nj->cni', projections[:, :, :3], points_xyz) + projections[:, None, :, 3]
+        cam_id, point_idx = np.nonzero(points_img[:, :, 2] > 0)
+        points_img = points_img[cam_id, point_idx]
+        depth = points_img[:, 2]
+        u = points_img[:, 0] / depth
+        v = points_img[:, 1] / depth
+        if clip_to_image:
+            if strict_bounds:
+                mask = (u >= 0) & (u < image_size[0]) & (v >= 0) & (v < image_size[1])
+            else:
+                # same rule as checking 0 <= int(u) < width: keep every point that truncates onto a pixel
+                mask = (u > -1) & (u < image_size[0]) & (v > -1) & (v < image_size[1])
+            point_idx, cam_id, u, v, depth = point_idx[mask], cam_id[mask], u[mask], v[mask], depth[mask]
+        return LidarProjection(point_idx, cam_id, u, v, depth)
+
     def project_lidar_to_image(self, seq_id, frame_id):
         points = self.load_point_cloud(seq_id, frame_id)
-
-        split_name = self._find_split_name(seq_id)
-        frame_info = getattr(self, '{}_info'.format(split_name))[seq_id][frame_id]
         points_img_dict = dict()
-        img_list, new_cam_intrinsic_dict = self.undistort_image_v2(seq_id, frame_id)
+        img_list, _ = self.undistort_image_v2(seq_id, frame_id)
+        projection = self.project_points_to_cameras(seq_id, frame_id, points, clip_to_image=False)
         for cam_no, cam_name in enumerate(self.__class__.camera_names):
-            calib_info = frame_info['calib'][cam_name]
-            cam_2_velo = calib_info['cam_to_velo']
-            cam_intri = np.hstack([new_cam_intrinsic_dict[cam_name], np.zeros((3, 1), dtype=np.float32)])
-            point_xyz = points[:, :3]
-            points_homo = np.hstack(
-                [point_xyz, np.ones(point_xyz.shape[0], dtype=np.float32).reshape((-1, 1))])
-            points_lidar = np.dot(points_homo, np.linalg.inv(cam_2_velo).T)
-            mask = points_lidar[:, 2] > 0
-            points_lidar = points_lidar[mask]
-            points_img = np.dot(points_lidar, cam_intri.T)
-            points_img = points_img / points_img[:, [2]]
             img_buf = img_list[cam_no]
-            for point in points_img:
+            sel = projection.cam_id == cam_no
+            for u, v in zip(projection.u[sel], projection.v[sel]):
                 try:
-                    cv2.circle(img_buf, (int(point[0]), int(point[1])), 2, color=(0, 0, 255), thickness=-1)
+                    cv2.circle(img_buf, (int(u), int(v)), 2, color=(0, 0, 255), thickness=-1)
                 except:
-                    print(int(point[0]), int(point[1]))
+                    print(int(u), int(v))
             points_img_dict[cam_name] = img_buf
         return points_img_dict
 
@@ -216,15 +480,13 @@ class ONCE(object):
         if split_name not in ['train', 'val']:
             print("seq id {} not in train/val, has no 2d annotations".format(seq_id))
             return
-        frame_info = getattr(self, '{}_info'.format(split_name))[seq_id][frame_id]
+        frame_info = self._get_frame_info(seq_id, frame_id)
         img_dict = dict()
-        img_list, new_cam_intrinsic_dict = self.undistort_image_v2(seq_id, frame_id)
+        img_list, _ = self.undistort_image_v2(seq_id, frame_id)
+        camera_models = self.get_camera_models(seq_id, self._get_image_size(img_list))
         for cam_no, cam_name in enumerate(self.__class__.camera_names):
             img_buf = img_list[cam_no]
-
-            calib_info = frame_info['calib'][cam_name]
-            cam_2_velo = calib_info['cam_to_velo']
-            cam_intri = np.hstack([new_cam_intrinsic_dict[cam_name], np.zeros((3, 1), dtype=np.float32)])
+            camera_model = camera_models[cam_name]
 
             cam_annos_3d = np.array(frame_info['annos']['boxes_3d'])
 
@@ -235,11 +497,8 @@ class ONCE(object):
             corners = np.einsum('nij,njk->nik', corners, rot_matrix) + cam_annos_3d[:, :3].reshape((-1, 1, 3))
 
             for i, corner in enumerate(corners):
-                points_homo = np.hstack([corner, np.ones(corner.shape[0], dtype=np.float32).reshape((-1, 1))])
-                points_lidar = np.dot(points_homo, np.linalg.inv(cam_2_velo).T)
-                mask = points_lidar[:, 2] > 0
-                points_lidar = points_lidar[mask]
-                points_img = np.dot(points_lidar, cam_intri.T)
+                points_img = camera_model.project(corner)
+                points_img = points_img[points_img[:, 2] > 0]
                 points_img = points_img / points_img[:, [2]]
                 if points_img.shape[0] != 16:
                     continue
@@ -258,6 +517,22 @@ class ONCE(object):
             img_dict[cam_name] = img_buf
         return img_dict
 
+    def get_frame_poses(self, seq_id, frame_ids):
+        """
+        Poses of several frames from one batched Rotation call
+        :return: rotation matrices (F, 3, 3) and translations (F, 3)
+        """
+        seq_info = self._get_seq_info(seq_id)
+        poses = np.array([seq_info[frame_id]['pose'] for frame_id in frame_ids], dtype=np.float64)
+        if poses.ndim != 2 or poses.shape[1] != 7:
+            raise ValueError('invalid pose information')
+        return Rotation.from_quat(poses[:, :4]).as_matrix(), poses[:, 4:]
+
+    def frame_point_count(self, seq_id, frame_id):
+        """Number of points in a sweep, from the .bin file size without reading it"""
+        bin_path = osp.join(self.data_root, seq_id, 'lidar_roof', '{}.bin'.format(frame_id))
+        return osp.getsize(bin_path) // (4 * np.dtype(np.float32).itemsize)
+
     def frame_concat(self, seq_id, frame_id, concat_cnt=0):
         """
         return new points coordinates according to pose info
@@ -265,34 +540,22 @@ class ONCE(object):
         :param frame_id:
         :return:
         """
-        split_name = self._find_split_name(seq_id)
-
-        seq_info = getattr(self, '{}_info'.format(split_name))[seq_id]
+        seq_info = self._get_seq_info(seq_id)
         start_idx = seq_info['frame_list'].index(frame_id)
+        frame_ids = [seq_info['frame_list'][i] for i in range(start_idx, start_idx + concat_cnt + 1)]
         points_list = []
-        translation_r = None
         try:
-            for i in range(start_idx, start_idx + concat_cnt + 1):
-                current_frame_id = seq_info['frame_list'][i]
-                frame_info = seq_info[current_frame_id]
-                transform_data = frame_info['pose']
-
-                points = self.load_point_cloud(seq_id, current_frame_id)
-                points_xyz = points[:, :3]
-
-                rotation = Rotation.from_quat(transform_data[:4]).as_matrix()
-                translation = np.array(transform_data[4:]).transpose()
-                points_xyz = np.dot(points_xyz, rotation.T)
-                points_xyz = points_xyz + translation
-                if i == start_idx:
-                    translation_r = translation
-                points_xyz = points_xyz - translation_r
-                points_list.append(np.hstack([points_xyz, points[:, 3:]]))
-        except ValueError:
+            rotations, translations = self.get_frame_poses(seq_id, frame_ids)
+        except (ValueError, TypeError):
             print('warning: part of the frames have no available pose information, return first frame point instead')
             points = self.load_point_cloud(seq_id, seq_info['frame_list'][start_idx])
             points_list.append(points)
             return points_list
+        translation_r = translations[0]
+        for current_frame_id, rotation, translation in zip(frame_ids, rotations, translations):
+            points = self.load_point_cloud(seq_id, current_frame_id)
+            points_xyz = np.dot(points[:, :3], rotation.T) + translation - translation_r
+            points_list.append(np.hstack([points_xyz, points[:, 3:]]))
         return points_list
 
     """
@@ -306,11 +569,13 @@ class ONCE(object):
         
     """
 
-    def project_own_lidar_to_image_remove_noise(self, seq_id, frame_id, strip_points):
-        # Retrieve frame information and undistort images
-        split_name = self._find_split_name(seq_id)
-        frame_info = getattr(self, '{}_info'.format(split_name))[seq_id][frame_id]
-        img_list, new_cam_intrinsic_dict = self.undistort_image_v2(seq_id, frame_id)
+    def project_own_lidar_to_image_remove_noise(self, seq_id, frame_id, strip_points, render=True):
+        """
+        :param render: draw the projected strips onto undistorted images, with False no image is read or
+                       drawn and the returned image dict is empty
+        """
+        img_list = self.undistort_image_v2(seq_id, frame_id)[0] if render else None
+        img_size = self._get_image_size(img_list)
         points_img_dict = {}
         return_dictionary = {
             'cam01': [],
@@ -321,40 +586,31 @@ class ONCE(object):
             'cam08': [],
             'cam09': []
         }
-        for cam_no, cam_name in enumerate(self.__class__.camera_names):
-            calib_info = frame_info['calib'][cam_name]
-            cam_to_velo = calib_info['cam_to_velo']
-            cam_intrinsic = np.hstack([new_cam_intrinsic_dict[cam_name], np.zeros((3, 1), dtype=np.float32)])
-            points = []
-            for strip_key, temp_points in strip_points.items():
-                if cam_name in strip_key:
-                    continue
-                for point in temp_points:
-                    points.append((strip_key, point))  # Append tuple of strip key and point
-
-            points_xyz = np.array([point[1][:3] for point in points])  # Extracting XYZ from points
-            points_homo = np.hstack([points_xyz, np.ones((points_xyz.shape[0], 1), dtype=np.float32)])
-            points_lidar = np.dot(points_homo, np.linalg.inv(cam_to_velo).T)
-            mask = points_lidar[:, 2] > 0
-            points_lidar = points_lidar[mask]
-            points_img = np.dot(points_lidar, cam_intrinsic.T)
-            points_img = points_img / points_img[:, [2]]
-            img_buf = img_list[cam_no]
-
-            valid_points = [points[i] for i in np.where(mask)[0]]  # Filter points list based on mask
-
-            for point, valid_point in zip(points_img, valid_points):
-                if 0 <= int(point[0]) < img_buf.shape[1] and 0 <= int(point[1]) < img_buf.shape[0]:
-                    try:
-                        # Include strip key in the return dictionary
-                        new_point = copy.copy(point)
-                        new_point = [new_point[0], img_buf.shape[0] - new_point[1], new_point[2]]
-                        return_dictionary[cam_name].append((valid_point[0], new_point))
-                        cv2.circle(img_buf, (int(point[0]), int(point[1])), 2, color=(50, 205, 50), thickness=-1)
-                    except:
-                        print(int(point[0]), int(point[1]))
+        strip_keys = []
+        strip_arrays = []
+        for strip_key, temp_points in strip_points.items():
+            temp_points = np.asarray(temp_points, dtype=np.float64)
+            strip_keys.append(strip_key)
+            strip_arrays.append(temp_points[:, :3] if len(temp_points) else np.zeros((0, 3)))
+        points_xyz = np.vstack(strip_arrays) if strip_arrays else np.zeros((0, 3))
+        point_strip = np.repeat(np.arange(len(strip_keys)), [len(arr) for arr in strip_arrays])
+        projection = self.project_points_to_cameras(seq_id, frame_id, points_xyz, image_size=img_size)
 
-            points_img_dict[cam_name] = img_buf
+        for cam_no, cam_name in enumerate(self.__class__.camera_names):
+            # strips of the camera itself are not projected back into it
+            own_strips = np.array([cam_name in strip_key for strip_key in strip_keys], dtype=bool)
+            sel = projection.cam_id == cam_no
+            if len(strip_keys):
+                sel &= ~own_strips[point_strip[projection.point_idx]]
+            for idx, u, v in zip(projection.point_idx[sel], projection.u[sel], projection.v[sel]):
+                # Include strip key in the return dictionary
+                new_point = [u, img_size[1] - v, 1.0]
+                return_dictionary[cam_name].append((strip_keys[point_strip[idx]], new_point))
+            if render:
+                img_buf = img_list[cam_no]
+                for u, v in zip(projection.u[sel], projection.v[sel]):
+                    cv2.circle(img_buf, (int(u), int(v)), 2, color=(50, 205, 50), thickness=-1)
+                points_img_dict[cam_name] = img_buf
         return points_img_dict, return_dictionary
 
     def project_2D_points_to_image(self, seq_id, frame_id, strips):
@@ -383,9 +639,8 @@ class ONCE(object):
 
 
     def get_vital_info(self, seq_id, frame_id):
-        split_name = self._find_split_name(seq_id)
-        frame_info = getattr(self, '{}_info'.format(split_name))[seq_id][frame_id]
-        _, new_cam_intrinsic_dict = self.undistort_image_v2(seq_id, frame_id)
+        frame_info = self._get_frame_info(seq_id, frame_id)
+        new_cam_intrinsic_dict = self.get_new_cam_intrinsics(seq_id, frame_id)
         extrinsic_dict = {}
         old_intrinsic_matrix = {}
         for cam_name in self.__class__.camera_names:
@@ -397,18 +652,21 @@ class ONCE(object):
 
         return new_cam_intrinsic_dict, old_intrinsic_matrix, extrinsic_dict
 
-    def project_lidar_to_image_with_colour(self, seq_id, frame_id, images = None):
+    def project_lidar_to_image_with_colour(self, seq_id, frame_id, images = None, render=True, return_index=False):
+        """
+        Colour every LiDAR point by the camera that sees it, grey when more than one camera sees it
+        :param return_index: also return the indices of unique_points into the loaded point cloud
+        :return: points_img_dict, unique_points, colors (and point_indices with return_index)
+        """
         points = self.load_point_cloud(seq_id, frame_id)
 
-        split_name = self._find_split_name(seq_id)
-        frame_info = getattr(self, f'{split_name}_info')[seq_id][frame_id]
         points_img_dict = {}
-        img_list, new_cam_intrinsic_dict = self.undistort_image_v2(seq_id, frame_id)
-        if images is None:
-            img_list, new_cam_intrinsic_dict = self.undistort_image_v2(seq_id, frame_id)
-        else:
+        img_list = None
+        if render and images is None:
+            img_list, _ = self.undistort_image_v2(seq_id, frame_id)
+        elif render:
             img_list = [self.load_own_image(path) for path in images]  # Load images from the paths provided
-        point_color_map = {}  # Dictionary to manage points and colors
+        img_size = self._get_image_size(img_list)
 
         # Define distinct colors for each camera
         camera_colors = {
@@ -420,81 +678,66 @@ class ONCE(object):
             'cam08': [0, 255, 255],  # Cyan
             'cam09': [255, 165, 0]  # Orange
         }
-
-        for cam_no, cam_name in enumerate(self.__class__.camera_names):
-            calib_info = frame_info['calib'][cam_name]
-            cam_2_velo = calib_info['cam_to_velo']
-            cam_intri = np.hstack([new_cam_intrinsic_dict[cam_name], np.zeros((3, 1), dtype=np.float32)])
-            point_xyz = points[:, :3]
-            points_homo = np.hstack([point_xyz, np.ones((point_xyz.shape[0], 1), dtype=np.float32)])
-            points_lidar = np.dot(points_homo, np.linalg.inv(cam_2_velo).T)
-
-            mask = points_lidar[:, 2] > 0
-            points_lidar = points_lidar[mask]
-            filtered_points = points[mask]
-            filtered_points = filtered_points[:, :3]
-            points_img = np.dot(points_lidar, cam_intri.T)
-            points_img /= points_img[:, [2]]
-
-            img_buf = img_list[cam_no]
-            for idx, point in enumerate(points_img):
-                point_tuple = tuple(filtered_points[idx])
-                if 0 <= int(point[0]) < img_buf.shape[1] and 0 <= int(point[1]) < img_buf.shape[0]:
-                    color = point_color_map.get(point_tuple, camera_colors[cam_name])
-                    if point_tuple in point_color_map:
-                        # If the point is already in the map and the color differs, set it to grey
-                        if point_color_map[point_tuple] != camera_colors[cam_name]:
-                            color = [120, 120, 120]  # Grey
-                    point_color_map[point_tuple] = color  # Update or set the color
-                    cv2.circle(img_buf, (int(point[0]), int(point[1])), 2, color=color, thickness=-1)
-                    #dictionary[cam_name].append([int(point[0]), int(point[1])])
-
-            points_img_dict[cam_name] = img_buf
-
-        # Convert point_color_map to arrays for Open3D
-        unique_points = np.array(list(point_color_map.keys()))
-        colors = np.array(list(point_color_map.values()))
-
+        camera_names = self.__class__.camera_names
+        palette = np.array([camera_colors[cam_name] for cam_name in camera_names])
+
+        projection = self.project_points_to_cameras(seq_id, frame_id, points, image_size=img_size)
+
+        # One bit per camera for every point of the cloud
+        visibility = np.zeros(points.shape[0], dtype=np.uint8 if len(camera_names) <= 8 else np.uint16)
+        for cam_no in range(len(camera_names)):
+            visibility[projection.point_idx[projection.cam_id == cam_no]] |= 1 << cam_no
+
+        point_indices = np.nonzero(visibility)[0]
+        seen_by = visibility[point_indices]
+        # more than one bit set means the point is seen by several cameras
+        multi_view = (seen_by & (seen_by - 1)) != 0
+        colors = palette[np.log2(seen_by).astype(int)]
+        colors[multi_view] = [120, 120, 120]  # Grey
+        unique_points = points[point_indices, :3]
+
+        if render:
+            point_colors = np.zeros((points.shape[0], 3), dtype=colors.dtype)
+            point_colors[point_indices] = colors
+            for cam_no, cam_name in enumerate(camera_names):
+                img_buf = img_list[cam_no]
+                sel = projection.cam_id == cam_no
+                for idx, u, v in zip(projection.point_idx[sel], projection.u[sel], projection.v[sel]):
+                    cv2.circle(img_buf, (int(u), int(v)), 2, color=point_colors[idx].tolist(), thickness=-1)
+                points_img_dict[cam_name] = img_buf
+
+        if return_index:
+            return points_img_dict, unique_points, colors, point_indices
         return points_img_dict, unique_points, colors
 
-    def tracking_lidar_to_image(self, seq_id, frame_id):
+    def tracking_lidar_to_image(self, seq_id, frame_id, render=True):
+        """
+        :return: points_img_dict and, per camera, a columnar point tracker with contiguous float32
+                 'uv' (N, 2) image coordinates, 'xyz' (N, 3) LiDAR coordinates and 'point_idx' into the cloud
+        """
         points = self.load_point_cloud(seq_id, frame_id)
 
-        split_name = self._find_split_name(seq_id)
-        frame_info = getattr(self, '{}_info'.format(split_name))[seq_id][frame_id]
         points_img_dict = dict()
-        img_list, new_cam_intrinsic_dict = self.undistort_image_v2(seq_id, frame_id)
+        img_list = self.undistort_image_v2(seq_id, frame_id)[0] if render else None
+        img_size = self._get_image_size(img_list)
+        projection = self.project_points_to_cameras(seq_id, frame_id, points, image_size=img_size, strict_bounds=True)
         image_lidar_points = {}
         for cam_no, cam_name in enumerate(self.__class__.camera_names):
-            image_lidar_points[cam_name] = []  # Initialize empty list for tuples
-            calib_info = frame_info['calib'][cam_name]
-            cam_2_velo = calib_info['cam_to_velo']
-            cam_intri = np.hstack([new_cam_intrinsic_dict[cam_name], np.zeros((3, 1), dtype=np.float32)])
-
-            point_xyz = points[:, :3]  # Select only X, Y, Z for transformations
-            points_homo = np.hstack(
-                [point_xyz, np.ones(point_xyz.shape[0], dtype=np.float32).reshape((-1, 1))])
-            points_lidar = np.dot(points_homo, np.linalg.inv(cam_2_velo).T)
-            mask = points_lidar[:, 2] > 0
-            points_lidar = points_lidar[mask]
-            points_img = np.dot(points_lidar, cam_intri.T)
-            points_img = points_img / points_img[:, [2]]  # Normalized with Z coordinate
-
-            img_buf = img_list[cam_no]
-
-            # Use the same mask to filter original LiDAR points but only select X, Y, Z
-            original_lidar_points = points[mask, :3]  # Trim to [X, Y, Z]
-
-            for point, lidar_point in zip(points_img, original_lidar_points):
-                x, y = point[0], point[1]  # Convert image coordinates to integer
-                if 0 <= x < img_buf.shape[1] and 0 <= y < img_buf.shape[0]:
-                    image_lidar_points[cam_name].append(([x, y], lidar_point))  # Store 2D image point
+            sel = projection.cam_id == cam_no
+            point_idx = projection.point_idx[sel]
+            image_lidar_points[cam_name] = {
+                'uv': np.stack([projection.u[sel], projection.v[sel]], axis=1).astype(np.float32),
+                'xyz': np.ascontiguousarray(points[point_idx, :3], dtype=np.float32),
+                'point_idx': point_idx
+            }
+            if render:
+                img_buf = img_list[cam_no]
+                for x, y in zip(projection.u[sel], projection.v[sel]):
                     cv2.circle(img_buf, (int(x), int(y)), 2, color=(0, 0, 255), thickness=-1)
-            points_img_dict[cam_name] = img_buf
+                points_img_dict[cam_name] = img_buf
         return points_img_dict, image_lidar_points
 
 
-
 if __name__ == '__main__':
     dataset = ONCE('/root')
     for seq_id, frame_id in [('000092', '1616442892300')]: